@@ -0,0 +1,187 @@
+import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union
+from crosstab import describe_numeric, get_crosstab, indicator_matrix
+from settings import load_settings
+from significance import choice_tables, significance_table
+from wjx import Result, ResultMultipleChoice, ResultNumericValue, ResultSingleChoice
+
+QTYPES = ["单选", "多选", "数值填空"]
+
+
+def read_questions(settings_path: str = "设置.xlsx") -> Dict[str, str]:
+    """题目映射中的 简化列名→题型，只保留可统计的题型"""
+    question_types = load_settings(settings_path).question_types
+    if question_types is None:
+        raise ValueError("题目映射中缺少[题型]列，无法批量分析")
+    return {q: t for q, t in question_types.items() if t in QTYPES}
+
+
+class ResultsCube:
+    """全部题目×拆分的统计结果
+
+    cube["Hb测量时机"]         全国统计
+    cube["Hb测量时机", "大区"]  分大区统计
+    cube.result("Hb测量时机")  对应的Result对象，计数已预先算好
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        questions: Dict[str, str],
+        breakouts: List[str],
+        weights: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.df = df
+        self.questions = {q: t for q, t in questions.items() if q in df.columns}
+        self.breakouts = breakouts
+        self.weights = weights or {}
+        self.results: Dict[str, Result] = {}
+        self.numeric_stats: Dict[Tuple[str, Optional[str]], pd.DataFrame] = {}
+
+        self._compute()
+
+    def _columns(self, qtype: str) -> List[str]:
+        return [q for q, t in self.questions.items() if t == qtype]
+
+    def _compute(self):
+        # 单选题：所有题目拼接后每个拆分只做一次bincount
+        single = self._columns("单选")
+        engine = get_crosstab(self.df)
+        for col_breakout in [None, *self.breakouts]:
+            if single:
+                engine.counts_many(single, col_breakout)
+        for q in single:
+            self.results[q] = ResultSingleChoice(
+                self.df, q, weights=self.weights.get(q)
+            )
+
+        # 多选题：各题的指示矩阵横向拼接，每个拆分只做一次分组求和
+        multiple = self._columns("多选")
+        if multiple:
+            indicators = [indicator_matrix(self.df[q]) for q in multiple]
+            stacked = pd.concat(indicators, axis=1, keys=multiple)
+            breakout_counts = {q: {} for q in multiple}
+            for col_breakout in self.breakouts:
+                sums = stacked.groupby(self.df[col_breakout], observed=True).sum().T
+                for q in multiple:
+                    breakout_counts[q][col_breakout] = sums.loc[q]
+            for q, indicator in zip(multiple, indicators):
+                self.results[q] = ResultMultipleChoice(
+                    self.df,
+                    q,
+                    indicator=indicator,
+                    breakout_counts=breakout_counts[q],
+                )
+
+        # 数值题：全国和每个拆分各一次排序，得到所有列的全部描述统计
+        numeric = self._columns("数值填空")
+        if numeric:
+            desc = describe_numeric(self.df, numeric).drop(columns="计数")
+            for q in numeric:
+                self.results[q] = ResultNumericValue(self.df, q)
+                self.numeric_stats[(q, None)] = desc.loc[q].rename(None)
+
+            for col_breakout in self.breakouts:
+                desc = describe_numeric(self.df, numeric, col_breakout)
+                for q in numeric:
+                    stats = desc.loc[q].copy()
+                    stats.index = (
+                        stats.index.astype(str)
+                        + "\n(n="
+                        + stats["计数"].astype(str)
+                        + ")"
+                    )
+                    self.numeric_stats[(q, col_breakout)] = stats
+
+    def result(self, question: str) -> Result:
+        return self.results[question]
+
+    def __getitem__(
+        self, key: Union[str, Tuple[str, Optional[str]]]
+    ) -> Union[pd.Series, pd.DataFrame]:
+        question, col_breakout = key if isinstance(key, tuple) else (key, None)
+        if (question, col_breakout) in self.numeric_stats:
+            return self.numeric_stats[(question, col_breakout)]
+        return self.results[question].get_stats(col_breakout=col_breakout)
+
+    def weighted_avg(
+        self, question: str, col_breakout: Optional[str] = None
+    ) -> Union[float, pd.Series, None]:
+        return self.results[question].weighted_avg(col_breakout=col_breakout)
+
+    def ci(
+        self, question: str, col_breakout: Optional[str] = None, **kwargs
+    ) -> pd.DataFrame:
+        """选择题占比的bootstrap置信区间，参数同Result.get_ci"""
+        return self.results[question].get_ci(col_breakout=col_breakout, **kwargs)
+
+    def significance(
+        self,
+        method: str = "bh",
+        alpha: float = 0.05,
+        only_significant: bool = True,
+    ) -> pd.DataFrame:
+        """所有选择题×拆分的卡方检验，多选题逐选项检验，校正后按显著程度排序
+
+        method: bh（Benjamini-Hochberg）、bonferroni或none
+        """
+        tables = []
+        for question, qtype in self.questions.items():
+            if qtype not in ["单选", "多选"]:
+                continue
+            r = self.results[question]
+            for col_breakout in self.breakouts:
+                counts = r.get_counts(col_breakout)
+                n = r.get_n(col_breakout) if qtype == "多选" else None
+                for item, table in choice_tables(counts, n):
+                    meta = {"题目": question, "题型": qtype, "拆分": col_breakout}
+                    tables.append(({**meta, "选项": item}, table))
+        return significance_table(tables, method, alpha, only_significant)
+
+    def to_frame(self) -> pd.DataFrame:
+        """长表：题目、题型、拆分、分组、选项/指标、值，便于导出"""
+        frames = []
+        for question, qtype in self.questions.items():
+            for col_breakout in [None, *self.breakouts]:
+                if qtype == "单选":
+                    stats = self.results[question].get_stats(
+                        col_breakout=col_breakout, add_base=False
+                    )
+                elif qtype == "多选":
+                    stats = self.results[question].get_stats(col_breakout=col_breakout)
+                    stats = stats.drop(columns="计数")
+                    if col_breakout:
+                        stats = stats.drop(columns="百分比")
+                else:
+                    stats = self.numeric_stats[(question, col_breakout)]
+                    if col_breakout:
+                        stats = stats.T
+
+                stats = stats.to_frame("全国") if isinstance(stats, pd.Series) else stats
+                long = stats.rename_axis(index="选项", columns="分组").stack()
+                long = long.rename("值").reset_index()
+                long.insert(0, "拆分", col_breakout or "全国")
+                long.insert(0, "题型", qtype)
+                long.insert(0, "题目", question)
+                frames.append(long)
+
+        return pd.concat(frames, ignore_index=True)
+
+
+def analyze(
+    df: pd.DataFrame,
+    settings_path: str = "设置.xlsx",
+    breakouts: Optional[List[str]] = None,
+    questions: Optional[Dict[str, str]] = None,
+    weights: Optional[Dict[str, Dict[str, float]]] = None,
+) -> ResultsCube:
+    """按题目映射中的题型一次性计算所有题目的全国及各拆分统计
+
+    weights: 题目→选项权重，用于单选题的加权平均
+    """
+    return ResultsCube(
+        df,
+        questions if questions is not None else read_questions(settings_path),
+        breakouts if breakouts is not None else ["大区"],
+        weights,
+    )
@@ -0,0 +1,324 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+from data_clean import PCT_COLS, clean_data
+from wjx import ResultMultipleChoice, ResultNumericValue, ResultSingleChoice
+
+REGIONS = ["东1区", "东2区", "中区", "北区", "南区", "西区"]
+
+WEIGHT_OPTIONS = ["＜20%", "20-40%", "40-60%", "60-80%", "＞80%"]
+
+# 简化列名: (题型, 选项)
+QUESTIONS = {
+    "门诊患者数": ("数值填空", None),
+    "病房患者数": ("数值填空", None),
+    **{col: ("数值填空", None) for col in PCT_COLS},
+    "Hb测量时机": (
+        "单选",
+        [
+            "新诊断的患者每个都测，复诊患者固定频率测量（例如：一月一次）",
+            "只有当患者主诉有贫血相关症状时或当CKD有进展时测",
+            "每个患者固定频率测量（例如：一月一次）",
+            "每个患者每次就诊都测",
+            "其他",
+        ],
+    ),
+    "ND-CKD1-2期合并肾性贫血比例": ("单选", WEIGHT_OPTIONS),
+    "ND-CKD3-5期合并肾性贫血比例": ("单选", WEIGHT_OPTIONS),
+    **{
+        f"基线{hb}新诊患者HIF使用比例": ("单选", WEIGHT_OPTIONS)
+        for hb in [">110g/L", "101-110g/L", "91-100g/L", "81-90g/L", "≤80g/L"]
+    },
+    "HIF治疗启动时机": (
+        "单选",
+        ["低于110g/L", "低于105g/L", "低于100g/L", "低于95g/L", "低于90g/L"],
+    ),
+    "处方罗沙司他的顾虑": (
+        "多选",
+        ["心血管风险", "血栓风险", "高钾血症", "价格", "医保限制", "其他"],
+    ),
+}
+
+
+def generate_survey(
+    n: int,
+    out_dir: str,
+    fmt: str = "xlsx",
+    n_hospitals: int = 300,
+    seed: int = 0,
+) -> Dict[str, str]:
+    """生成问卷星格式的模拟导出文件和配套的设置.xlsx"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 医院及内部架构，约2%的医院不在架构表中
+    hospitals = np.array([f"第{i}人民医院" for i in range(n_hospitals)], dtype=object)
+    provinces = np.array([f"省份{i % 31}‐城市{i % 97}‐" for i in range(n_hospitals)])
+    df_internal = pd.DataFrame(
+        {"目标名称": hospitals, "大区": rng.choice(REGIONS, n_hospitals)}
+    ).iloc[: int(n_hospitals * 0.98)]
+    h = rng.integers(0, n_hospitals, n)
+
+    raw = {
+        "序号": np.arange(1, n + 1),
+        "提交答卷时间": pd.Timestamp("2024-01-01")
+        + pd.to_timedelta(rng.integers(0, 86400 * 30, n), unit="s"),
+        "所用时间": [f"{s}秒" for s in rng.integers(60, 900, n)],
+        "来源": "手机提交",
+        "总分": 0,
+        "医院": (provinces[h] + hospitals[h]).astype(object),
+        "姓名": np.char.add("医生", np.arange(n).astype(str)).astype(object),
+    }
+
+    rename = {}
+    for i, (col, (qtype, options)) in enumerate(QUESTIONS.items()):
+        raw_col = f"{i + 1}. {col}（{qtype}）"
+        rename[raw_col] = col
+        if col in ["门诊患者数", "病房患者数"]:
+            values = rng.lognormal(5 if col == "门诊患者数" else 4, 0.8, n).round()
+        elif qtype == "数值填空":
+            values = rng.integers(0, 101, n).astype(float)
+        elif qtype == "单选":
+            values = rng.choice(
+                np.array(options, dtype=object), n, p=rng.dirichlet(np.ones(len(options)))
+            )
+        else:
+            # 所有非空组合预先拼好，按位掩码抽取
+            combos = np.array(
+                [
+                    "┋".join(o for j, o in enumerate(options) if mask >> j & 1)
+                    for mask in range(1, 2 ** len(options))
+                ],
+                dtype=object,
+            )
+            values = combos[rng.integers(0, len(combos), n)]
+
+        # 约3%的缺失
+        values = pd.Series(values)
+        values[rng.random(n) < 0.03] = np.nan
+        raw[raw_col] = values
+
+    df_raw = pd.DataFrame(raw)
+    export_path = os.path.join(out_dir, f"survey_{n}.{fmt}")
+    if fmt == "csv":
+        df_raw.to_csv(export_path, index=False)
+    else:
+        df_raw.to_excel(export_path, index=False)
+
+    settings_path = os.path.join(out_dir, "设置.xlsx")
+    df_q = pd.DataFrame(
+        {
+            "原始列名": list(rename.keys()),
+            "简化列名": list(rename.values()),
+            "题型": [qtype for qtype, _ in QUESTIONS.values()],
+        }
+    )
+    with pd.ExcelWriter(settings_path) as writer:
+        df_q.to_excel(writer, sheet_name="题目映射", index=False)
+        df_internal.to_excel(writer, sheet_name="内部架构", index=False)
+
+    return {"export": export_path, "settings": settings_path}
+
+
+def measure(func: Callable) -> Dict[str, float]:
+    """单个阶段的耗时和峰值内存，阶段内的print输出被屏蔽"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": elapsed, "peak_mb": peak / 2**20}
+
+
+# 统计、绘图、报告各层的入口模块
+IMPORT_MODULES = ["wjx", "analysis", "render", "presentation"]
+HEAVY_MODULES = ["matplotlib", "pptx"]
+
+
+def _run_import(module: str, trace_memory: bool) -> Optional[Dict]:
+    code = (
+        "import json, sys, time, tracemalloc\n"
+        + ("tracemalloc.start()\n" if trace_memory else "")
+        + "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': elapsed,"
+        " 'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20,"
+        f" 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        print(f"无法导入{module}：{proc.stderr.strip().splitlines()[-1]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def measure_import(module: str) -> Optional[Dict]:
+    """在新的解释器中测量导入耗时和峰值内存，并记录是否连带导入了绘图/pptx模块
+
+    tracemalloc会显著拖慢导入，耗时和内存分两次测量；模块依赖未安装时返回None
+    """
+    timing = _run_import(module, trace_memory=False)
+    if timing is None:
+        return None
+    memory = _run_import(module, trace_memory=True)
+    return {**timing, "peak_mb": memory["peak_mb"]}
+
+
+def run_benchmark(
+    paths: Dict[str, str],
+    col_breakout: str = "大区",
+    template: Optional[str] = None,
+    workers: int = 1,
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    state = {}
+
+    def stage_clean():
+        state["df"] = clean_data(paths["export"], paths["settings"], use_cache=False)
+
+    results["clean_data"] = measure(stage_clean)
+    df = state["df"]
+
+    single = [col for col, (qtype, _) in QUESTIONS.items() if qtype == "单选"]
+    multiple = [col for col, (qtype, _) in QUESTIONS.items() if qtype == "多选"]
+    numeric = [col for col, (qtype, _) in QUESTIONS.items() if qtype == "数值填空"]
+    weights = dict(zip(WEIGHT_OPTIONS, [0.1, 0.3, 0.5, 0.7, 0.9]))
+
+    def stage_single():
+        for col in single:
+            r = ResultSingleChoice(df, col)
+            r.get_stats()
+            r.get_stats(col_breakout=col_breakout)
+
+    def stage_weighted():
+        for col in single:
+            r = ResultSingleChoice(df, col, weights=weights)
+            r.weighted_avg()
+            r.weighted_avg(col_breakout=col_breakout)
+
+    def stage_multiple():
+        for col in multiple:
+            ResultMultipleChoice(df, col).get_stats(col_breakout=col_breakout)
+
+    def stage_numeric():
+        for col in numeric:
+            ResultNumericValue(df, col).get_stats()
+
+    results["single_get_stats"] = measure(stage_single)
+    results["single_weighted_avg"] = measure(stage_weighted)
+    results["multiple_get_stats"] = measure(stage_multiple)
+    results["numeric_get_stats"] = measure(stage_numeric)
+
+    if template:
+        from presentation import PPT_survey
+
+        def stage_deck():
+            p = PPT_survey(template, workers=workers)
+            for col in single:
+                p.add_content_standard(
+                    ResultSingleChoice(df, col, weights=weights),
+                    col_breakout=col_breakout,
+                )
+            p.save(os.path.join(os.path.dirname(paths["export"]), "benchmark.pptx"))
+
+        results["deck"] = measure(stage_deck)
+
+    return results
+
+
+def compare(
+    current: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    threshold: float = 1.2,
+) -> pd.DataFrame:
+    """与基线对比，耗时或内存超过基线threshold倍的阶段标记为退步"""
+    rows = []
+    for n, stages in current.items():
+        for stage, m in stages.items():
+            b = baseline.get(n, {}).get(stage)
+            if b is None:
+                continue
+            time_ratio = m["seconds"] / b["seconds"] if b["seconds"] else np.nan
+            mem_ratio = m["peak_mb"] / b["peak_mb"] if b["peak_mb"] else np.nan
+            rows.append(
+                {
+                    "样本量": n,
+                    "阶段": stage,
+                    "耗时(s)": m["seconds"],
+                    "基线耗时(s)": b["seconds"],
+                    "耗时比": time_ratio,
+                    "峰值内存(MB)": m["peak_mb"],
+                    "基线内存(MB)": b["peak_mb"],
+                    "内存比": mem_ratio,
+                    "退步": time_ratio > threshold or mem_ratio > threshold,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="问卷清洗及统计流程基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--out-dir", default="benchmark_data")
+    parser.add_argument(
+        "--format", choices=["auto", "xlsx", "csv"], default="auto",
+        help="auto: 10万行以内用xlsx，更大用csv",
+    )
+    parser.add_argument("--template", help="提供pptx模板时测试整份报告的生成")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--imports", action="store_true", help="同时测量各入口模块的导入耗时"
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="与之对比的基线json")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for n in args.sizes:
+        fmt = args.format if args.format != "auto" else ("xlsx" if n <= 100000 else "csv")
+        paths = generate_survey(n, os.path.join(args.out_dir, str(n)), fmt=fmt)
+        results[str(n)] = run_benchmark(
+            paths, template=args.template, workers=args.workers
+        )
+
+    if args.imports:
+        imports = {m: measure_import(m) for m in IMPORT_MODULES}
+        results["import"] = {m: r for m, r in imports.items() if r is not None}
+
+    df = pd.DataFrame(
+        [{"样本量": n, "阶段": s, **m} for n, r in results.items() for s, m in r.items()]
+    )
+    print(df.to_string(index=False))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        df_compare = compare(results, baseline, args.threshold)
+        print(df_compare.to_string(index=False))
+        if df_compare["退步"].any():
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
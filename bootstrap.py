@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+
+# 每块重抽样次数，分块和随机种子与进程数无关，保证结果可复现
+BLOCK_SIZE = 2000
+
+
+def _resample_block(
+    counts: np.ndarray, n: Optional[np.ndarray], size: int, seed: np.random.SeedSequence
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    totals = counts.sum(axis=0) if n is None else n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.nan_to_num(counts / totals)
+
+    if n is None:
+        # 单选：每个分组内按各自样本量做多项分布抽样，(分组, 选项)
+        p[:, totals == 0] = 1 / len(counts)
+        samples = rng.multinomial(totals, p.T, size=(size, counts.shape[1]))
+        return samples.transpose(0, 2, 1)
+    # 多选：每个选项各自是二项分布，给出各选项占比的边际区间
+    return rng.binomial(totals, p, size=(size, *counts.shape))
+
+
+def resample_counts(
+    counts: np.ndarray,
+    n: Optional[np.ndarray] = None,
+    n_resamples: int = 10000,
+    seed: int = 0,
+    workers: int = 1,
+) -> np.ndarray:
+    """由 选项×分组 计数矩阵一次生成全部重抽样计数，形状为(n_resamples, 选项, 分组)
+
+    n为None时按单选题做多项分布重抽样；给出各分组有效样本量n时按多选题逐选项做二项分布
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    n = None if n is None else np.asarray(n, dtype=np.int64)
+    sizes = [BLOCK_SIZE] * (n_resamples // BLOCK_SIZE)
+    if n_resamples % BLOCK_SIZE:
+        sizes.append(n_resamples % BLOCK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([counts] * len(sizes), [n] * len(sizes), sizes, seeds)
+
+    if workers <= 1 or len(sizes) <= 1:
+        blocks = list(map(_resample_block, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes))) as pool:
+            blocks = list(pool.map(_resample_block, *args))
+    return np.concatenate(blocks)
+
+
+def percentile_interval(
+    samples: np.ndarray, level: float = 0.95
+) -> Tuple[np.ndarray, np.ndarray]:
+    alpha = (1 - level) / 2
+    with np.errstate(invalid="ignore"):
+        lower, upper = np.nanquantile(samples, [alpha, 1 - alpha], axis=0)
+    return lower, upper
+
+
+def _as_matrix(counts: Union[pd.Series, pd.DataFrame]) -> np.ndarray:
+    values = counts.to_numpy()
+    return values[:, None] if isinstance(counts, pd.Series) else values
+
+
+def share_ci(
+    counts: Union[pd.Series, pd.DataFrame],
+    n: Union[int, pd.Series, None] = None,
+    n_resamples: int = 10000,
+    level: float = 0.95,
+    seed: int = 0,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """各选项占比的bootstrap百分位置信区间
+
+    counts为Series时返回 选项×[百分比, 下限, 上限]；
+    为 选项×分组 的DataFrame时返回的列为(分组, [百分比, 下限, 上限])
+    n: 多选题的有效样本量（全国为整数，分组为Series），单选题不需要
+    """
+    c = _as_matrix(counts)
+    totals = c.sum(axis=0) if n is None else np.atleast_1d(np.asarray(n))
+    samples = resample_counts(c, None if n is None else totals, n_resamples, seed, workers)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shares = c / totals
+        lower, upper = percentile_interval(samples / totals, level)
+
+    frames = [
+        pd.DataFrame(
+            {"百分比": shares[:, j], "下限": lower[:, j], "上限": upper[:, j]},
+            index=counts.index,
+        )
+        for j in range(c.shape[1])
+    ]
+    if isinstance(counts, pd.Series):
+        return frames[0]
+    return pd.concat(frames, axis=1, keys=counts.columns)
+
+
+def weighted_avg_ci(
+    counts: Union[pd.Series, pd.DataFrame],
+    weights: Dict[str, float],
+    n_resamples: int = 10000,
+    level: float = 0.95,
+    seed: int = 0,
+    workers: int = 1,
+) -> Union[pd.Series, pd.DataFrame]:
+    """单选题加权平均的bootstrap区间，口径与weighted_avg_from_counts一致
+
+    counts为Series时返回[加权平均, 下限, 上限]，为DataFrame时每个分组一行
+    """
+    c = _as_matrix(counts)
+    w = counts.index.map(weights).to_numpy(dtype=float)
+    mapped = ~np.isnan(w)
+    samples = resample_counts(c, None, n_resamples, seed, workers)[:, mapped]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = w[mapped] @ c[mapped] / c[mapped].sum(axis=0)
+        resampled = np.einsum("k,rkm->rm", w[mapped], samples) / samples.sum(axis=1)
+    lower, upper = percentile_interval(resampled, level)
+
+    stats = pd.DataFrame({"加权平均": avg, "下限": lower, "上限": upper})
+    if isinstance(counts, pd.Series):
+        return stats.iloc[0].rename(None)
+    stats.index = counts.columns
+    return stats
@@ -0,0 +1,479 @@
+import weakref
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def _column_token(series: pd.Series) -> tuple:
+    """列数据所在的底层数组：numpy列取数据地址，扩展类型取数组对象"""
+    arr = series.array
+    if isinstance(arr, pd.arrays.NumpyExtensionArray):
+        return ("numpy", np.asarray(arr).__array_interface__["data"][0])
+    return ("extension", id(arr))
+
+
+class Crosstab:
+    """单个数据集的交叉表引擎：每列只编码一次，计数矩阵按(题目, 拆分)记忆
+
+    每个编码过的列都保留一份列引用，在写时复制下数据集中该列被替换或原地修改后
+    底层数组会变化，再次使用时检测到变化即清空缓存
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = weakref.ref(df)
+        self._n = len(df)
+        # 列 → (编码时的列引用, 底层数组标识)
+        self._columns: Dict[str, Tuple[pd.Series, tuple]] = {}
+        self._codes: Dict[str, Tuple[np.ndarray, pd.Index]] = {}
+        self._counts: Dict[Tuple[str, Optional[str]], Union[pd.Series, pd.DataFrame]] = {}
+        self._weighted: Dict[tuple, Union[float, pd.Series]] = {}
+        self._cubes: Dict[Tuple[str, Tuple[str, ...]], "BreakoutCube"] = {}
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._df()
+
+    def clear(self):
+        """数据集被原地修改后需要清空缓存"""
+        self._n = len(self.df)
+        self._columns.clear()
+        self._codes.clear()
+        self._counts.clear()
+        self._weighted.clear()
+        self._cubes.clear()
+
+    def validate(self, cols: List[Optional[str]]):
+        """行数变化或任一列的底层数组变化时清空缓存"""
+        df = self.df
+        changed = [
+            col
+            for col in cols
+            if col in self._columns
+            and (
+                col not in df.columns
+                or _column_token(df[col]) != self._columns[col][1]
+            )
+        ]
+        if len(df) != self._n or changed:
+            self.clear()
+
+    def codes(self, col: str) -> Tuple[np.ndarray, pd.Index]:
+        """整数编码（缺失值为-1）及排序后的类别"""
+        self.validate([col])
+
+        if col not in self._codes:
+            # 分类列按设置中的类别顺序编码，只保留出现过的类别
+            series = self.df[col]
+            codes, categories = pd.factorize(series, sort=True)
+            self._columns[col] = (series, _column_token(series))
+            self._codes[col] = (codes, pd.Index(np.asarray(categories), name=col))
+        return self._codes[col]
+
+    def counts(
+        self, col_question: str, col_breakout: Union[str, List[str], None] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """无拆分时返回各选项计数，有拆分时返回 选项×分组 计数矩阵
+
+        col_breakout为列表时是多层拆分，列为出现过的分组组合
+        """
+        if isinstance(col_breakout, (list, tuple)):
+            return self.cube(col_question, col_breakout).matrix()
+        return self.counts_many([col_question], col_breakout)[col_question]
+
+    def counts_many(
+        self, cols: List[str], col_breakout: Optional[str] = None
+    ) -> Dict[str, Union[pd.Series, pd.DataFrame]]:
+        """多道题拼接编码后一次bincount得到全部计数矩阵"""
+        self.validate([*cols, col_breakout])
+
+        todo = [col for col in cols if (col, col_breakout) not in self._counts]
+        if todo:
+            encoded = [self.codes(col) for col in todo]
+            sizes = np.array([len(cats) for _, cats in encoded])
+            offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+            codes = np.column_stack([c for c, _ in encoded])
+            valid = codes >= 0
+
+            if col_breakout is None:
+                b_codes, b_cats = np.zeros(len(codes), dtype=np.intp), None
+            else:
+                b_codes, b_cats = self.codes(col_breakout)
+                valid &= (b_codes >= 0)[:, None]
+            nb = 1 if b_cats is None else len(b_cats)
+
+            flat = (codes + offsets) * nb + b_codes[:, None]
+            counts = np.bincount(flat[valid], minlength=sizes.sum() * nb).reshape(
+                sizes.sum(), nb
+            )
+
+            for col, (_, cats), offset, size in zip(todo, encoded, offsets, sizes):
+                block = counts[offset : offset + size]
+                if b_cats is None:
+                    self._counts[(col, None)] = pd.Series(
+                        block[:, 0], index=cats, name="count"
+                    )
+                else:
+                    self._counts[(col, col_breakout)] = pd.DataFrame(
+                        block, index=cats, columns=b_cats
+                    )
+
+        return {col: self._counts[(col, col_breakout)] for col in cols}
+
+    def combo_codes(self, breakouts: List[str]) -> Tuple[np.ndarray, List[pd.Index]]:
+        """多层拆分按混合进制合成一个整数编码，每层的缺失值单独作为编码len(cats)
+
+        缺失不丢弃整行，其他层求边际时这些行仍然计入
+        """
+        flat = np.zeros(self._n, dtype=np.int64)
+        levels = []
+        for col in breakouts:
+            codes, cats = self.codes(col)
+            flat = flat * (len(cats) + 1) + np.where(codes >= 0, codes, len(cats))
+            levels.append(cats)
+        return flat, levels
+
+    def cube(self, col_question: str, breakouts: List[str]) -> "BreakoutCube":
+        """单选题×多层拆分的稀疏计数立方体，一次排序计数得到全部出现过的组合"""
+        key = (col_question, tuple(breakouts))
+        self.validate([col_question, *breakouts])
+        if key in self._cubes:
+            return self._cubes[key]
+
+        q_codes, q_cats = self.codes(col_question)
+        b_flat, levels = self.combo_codes(list(breakouts))
+        radix = np.prod([len(cats) + 1 for cats in levels], dtype=np.int64)
+
+        valid = q_codes >= 0
+        keys, counts = np.unique(
+            q_codes[valid] * radix + b_flat[valid], return_counts=True
+        )
+        options, combos = np.divmod(keys, radix)
+        index = combo_index(combos, levels, [q_cats], [options])
+        counts = pd.Series(counts, index=index, name="count")
+
+        base = counts.groupby(level=list(breakouts), dropna=False).sum()
+        cube = BreakoutCube(counts, base)
+        self._cubes[key] = cube
+        return cube
+
+    def weighted_avg(
+        self,
+        col_question: str,
+        weights: Dict[str, float],
+        col_breakout: Union[str, List[str], None] = None,
+    ) -> Union[float, pd.Series]:
+        """权重向量与计数矩阵做一次点积，未配置权重的选项不计入分母"""
+        if isinstance(col_breakout, list):
+            col_breakout = tuple(col_breakout)
+        key = (col_question, tuple(weights.items()), col_breakout)
+        if isinstance(col_breakout, tuple):
+            self.validate([col_question, *col_breakout])
+        else:
+            self.validate([col_question, col_breakout])
+        if key in self._weighted:
+            return self._weighted[key]
+
+        avg = weighted_avg_from_counts(self.counts(col_question, col_breakout), weights)
+        self._weighted[key] = avg
+        return avg
+
+
+def weighted_avg_from_counts(
+    counts: Union[pd.Series, pd.DataFrame], weights: Dict[str, float]
+) -> Union[float, pd.Series]:
+    """权重向量与计数矩阵做一次点积，未配置权重的选项不计入分母"""
+    w = counts.index.map(weights).to_numpy(dtype=float)
+    mapped = ~np.isnan(w)
+    c = counts.to_numpy()[mapped]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = w[mapped] @ c / c.sum(axis=0)
+
+    if isinstance(counts, pd.DataFrame):
+        avg = pd.Series(avg, index=counts.columns)
+    return avg
+
+
+def choice_stats(
+    counts_total: pd.Series,
+    counts_breakout: Optional[pd.DataFrame] = None,
+    percentage: bool = True,
+    sorter: Optional[List[str]] = None,
+    add_base: bool = True,
+) -> Union[pd.Series, pd.DataFrame]:
+    """由计数生成单选题统计表，格式与ResultSingleChoice.get_stats一致"""
+    stats_total = counts_total[counts_total > 0]
+    if percentage:
+        stats_total = stats_total.div(counts_total.sum())
+
+    stats_total = stats_total.sort_values(ascending=False)
+    print(stats_total)
+
+    stats = stats_total
+    if counts_breakout is not None:
+        count = counts_breakout.sum()
+        count = count[count > 0]
+        stats = counts_breakout[count.index].reindex(stats_total.index)
+        if percentage:
+            stats = stats.div(count)
+
+        if add_base:
+            stats.columns = stats.columns + "\n(n=" + count.astype(str) + ")"
+
+    if sorter:
+        stats = stats.reindex(sorter)
+
+    return stats
+
+
+def indicator_matrix(data: pd.Series, delimiter: str = "┋") -> pd.DataFrame:
+    """多选题拆分为 受访者×选项 的布尔矩阵，每道题只做一次字符串处理"""
+    answers = (
+        data.reset_index(drop=True).dropna().astype(str).str.split(delimiter).explode()
+    )
+    codes, items = pd.factorize(answers)
+    matrix = np.zeros((len(data), len(items)), dtype=bool)
+    matrix[answers.index.to_numpy(), codes] = True
+    return pd.DataFrame(matrix, index=data.index, columns=pd.Index(items))
+
+
+def multiple_choice_stats(
+    counts_total: pd.Series,
+    valid_n: int,
+    counts_breakout: Optional[pd.DataFrame] = None,
+    n_breakout: Optional[pd.Series] = None,
+    sorter: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """由计数生成多选题统计表，格式与ResultMultipleChoice.get_stats一致"""
+    stats = pd.DataFrame()
+    stats["计数"] = counts_total[counts_total > 0].sort_values(ascending=False)
+    stats["百分比"] = stats["计数"] / valid_n
+
+    if counts_breakout is not None:
+        stats = stats.join(counts_breakout.div(n_breakout))
+
+    if sorter:
+        stats = stats.reindex(sorter)
+
+    return stats
+
+
+def _complete(index: pd.Index) -> np.ndarray:
+    """各层都不缺失的组合"""
+    if isinstance(index, pd.MultiIndex):
+        return np.all([codes >= 0 for codes in index.codes], axis=0)
+    return index.notna()
+
+
+def combo_index(
+    combos: np.ndarray,
+    levels: List[pd.Index],
+    outer_levels: Optional[List[pd.Index]] = None,
+    outer_codes: Optional[List[np.ndarray]] = None,
+) -> pd.MultiIndex:
+    """混合进制的组合编码还原为MultiIndex，只包含实际出现的组合，缺失层的标签为NaN"""
+    codes = [
+        np.where(c < len(cats), c, -1)
+        for c, cats in zip(
+            np.unravel_index(combos, [len(cats) + 1 for cats in levels]), levels
+        )
+    ]
+    levels = [*(outer_levels or []), *levels]
+    return pd.MultiIndex(
+        levels=levels,
+        codes=[*(outer_codes or []), *codes],
+        names=[cats.name for cats in levels],
+    )
+
+
+class BreakoutCube:
+    """题目×多层拆分的稀疏计数，只保存计数不为0的(选项, 分组组合)
+
+    counts: 索引为(选项, 拆分1, 拆分2, ...)的计数
+    base: 索引为(拆分1, 拆分2, ...)的有效样本量
+    任意边际或子集都由这两个Series求和得到，不再回到原始数据分组；
+    拆分缺失的行以NaN标签保留，求边际时计入其他层，只在matrix和n中去掉
+    """
+
+    def __init__(self, counts: pd.Series, base: pd.Series):
+        self.counts = counts
+        self.base = base
+
+    @property
+    def breakouts(self) -> List[str]:
+        return list(self.base.index.names)
+
+    def subset(self, **filters) -> "BreakoutCube":
+        """按拆分取值筛选组合，例如cube.subset(大区="东1区", 职称=["主任医师", "副主任医师"])"""
+        counts, base = self.counts, self.base
+        for col, values in filters.items():
+            values = values if isinstance(values, (list, tuple)) else [values]
+            counts = counts[counts.index.get_level_values(col).isin(values)]
+            base = base[base.index.get_level_values(col).isin(values)]
+        return BreakoutCube(counts, base)
+
+    def margin(self, breakouts: List[str]) -> "BreakoutCube":
+        """对其余拆分求和，只保留breakouts这几层"""
+        levels = [self.counts.index.names[0], *breakouts]
+        return BreakoutCube(
+            self.counts.groupby(level=levels, observed=True, dropna=False).sum(),
+            self.base.groupby(level=breakouts, observed=True, dropna=False).sum(),
+        )
+
+    def total(self) -> pd.Series:
+        """全部组合合计的各选项计数"""
+        return self.counts.groupby(level=0, observed=True).sum()
+
+    def _labels(self, index: pd.Index, sep: str) -> pd.Index:
+        if index.nlevels == 1:
+            return index.get_level_values(0).astype(str)
+        return pd.Index([sep.join(map(str, key)) for key in index])
+
+    def _base(self) -> pd.Series:
+        return self.base[_complete(self.base.index) & (self.base > 0).to_numpy()]
+
+    def n(self, sep: str = "/") -> pd.Series:
+        base = self._base()
+        return pd.Series(base.to_numpy(), index=self._labels(base.index, sep))
+
+    def matrix(self, sep: str = "/") -> pd.DataFrame:
+        """选项×分组组合 的计数矩阵，多层拆分的组合名以sep连接，不含拆分缺失的组合"""
+        counts = self.counts[_complete(self.counts.index)]
+        matrix = counts.unstack(level=self.breakouts, fill_value=0)
+        if isinstance(matrix, pd.Series):
+            matrix = matrix.to_frame()
+        matrix = matrix.reindex(columns=self._base().index, fill_value=0)
+        matrix.columns = self._labels(matrix.columns, sep)
+        matrix.index.name = self.counts.index.names[0]
+        return matrix
+
+
+def indicator_cube(
+    indicator: pd.DataFrame,
+    answered: np.ndarray,
+    combos: np.ndarray,
+    levels: List[pd.Index],
+    col_question: str,
+) -> BreakoutCube:
+    """多选题×多层拆分的稀疏计数立方体，各组合样本量为该组合中作答的人数"""
+    keys, inverse = np.unique(combos, return_inverse=True)
+    values = indicator.to_numpy()
+    counts = np.stack(
+        [
+            np.bincount(inverse, weights=values[:, j], minlength=len(keys))
+            for j in range(values.shape[1])
+        ],
+        axis=1,
+    ).astype(np.int64)
+    base = np.bincount(inverse, weights=answered, minlength=len(keys))
+
+    options, rows = np.nonzero(counts.T)
+    index = combo_index(
+        keys[rows], levels, [pd.Index(indicator.columns, name=col_question)], [options]
+    )
+    return BreakoutCube(
+        pd.Series(counts[rows, options], index=index, name="count"),
+        pd.Series(base.astype(np.int64), index=combo_index(keys, levels)),
+    )
+
+
+NUMERIC_STATS = [
+    "计数", "平均值", "标准差", "最小值", "25%分位数", "中位数", "75%分位数", "最大值"
+]
+
+
+def grouped_describe(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """多列数值按分组一次排序得到全部描述统计，返回(分组, 列, 统计量)数组
+
+    groups为-1的行不计入任何分组；分位数与pandas默认的线性插值一致
+    """
+    n, n_cols = values.shape
+    valid = ~np.isnan(values) & (groups >= 0)[:, None]
+    # 先按数值排序（NaN排在inf之后），再稳定地按分组排序，得到 组内有序、缺失在组尾 的顺序
+    order = np.argsort(values, axis=0)
+    order = np.take_along_axis(
+        order, np.argsort(groups[order], axis=0, kind="stable"), axis=0
+    )
+    ordered = np.take_along_axis(values, order, axis=0)
+
+    rows, cols = np.nonzero(valid)
+    cells = groups[rows] * n_cols + cols
+    x = values[rows, cols]
+    size = n_groups * n_cols
+    counts = np.bincount(cells, minlength=size).reshape(n_groups, n_cols)
+    sums = np.bincount(cells, weights=x, minlength=size).reshape(n_groups, n_cols)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        sq = np.bincount(
+            cells, weights=(x - means.ravel()[cells]) ** 2, minlength=size
+        ).reshape(n_groups, n_cols)
+        stds = np.where(counts > 1, np.sqrt(sq / (counts - 1)), np.nan)
+
+    # 各分组在排序结果中的起始位置，-1分组排在最前
+    sizes = np.bincount(groups + 1, minlength=n_groups + 1)
+    starts = np.broadcast_to(np.cumsum(sizes)[:-1, None], (n_groups, n_cols))
+
+    def quantile(q: float) -> np.ndarray:
+        pos = starts + (counts - 1) * q
+        lo = np.clip(np.floor(pos).astype(np.int64), 0, n - 1)
+        hi = np.clip(np.ceil(pos).astype(np.int64), 0, n - 1)
+        a = np.take_along_axis(ordered, lo, axis=0)
+        b = np.take_along_axis(ordered, hi, axis=0)
+        # 位置恰为整数时直接取值，避免inf参与插值得到NaN
+        with np.errstate(invalid="ignore"):
+            value = np.where(lo == hi, a, a + (b - a) * (pos - lo))
+        return np.where(counts > 0, value, np.nan)
+
+    return np.stack(
+        [
+            counts,
+            means,
+            stds,
+            quantile(0),
+            quantile(0.25),
+            quantile(0.5),
+            quantile(0.75),
+            quantile(1),
+        ],
+        axis=2,
+    )
+
+
+def describe_numeric(
+    df: pd.DataFrame, cols: List[str], col_breakout: Optional[str] = None
+) -> pd.DataFrame:
+    """多个数值字段一次计算全部描述统计
+
+    无拆分时索引为字段；有拆分时索引为(字段, 分组)，只包含有样本的分组
+    """
+    values = df[cols].to_numpy(dtype=float, na_value=np.nan)
+    if col_breakout is None:
+        groups, cats = np.zeros(len(df), dtype=np.int64), None
+    else:
+        groups, cats = get_crosstab(df).codes(col_breakout)
+    n_groups = 1 if cats is None else len(cats)
+
+    stats = grouped_describe(values, np.asarray(groups, dtype=np.int64), n_groups)
+    if cats is None:
+        result = pd.DataFrame(stats[0], index=pd.Index(cols), columns=NUMERIC_STATS)
+    else:
+        index = pd.MultiIndex.from_product([cats, cols], names=[col_breakout, "字段"])
+        result = pd.DataFrame(
+            stats.reshape(-1, len(NUMERIC_STATS)), index=index, columns=NUMERIC_STATS
+        )
+        result = result[result["计数"] > 0].swaplevel().reindex(cols, level=0)
+    result["计数"] = result["计数"].astype(int)
+    return result
+
+
+_ENGINES: Dict[int, Crosstab] = {}
+
+
+def get_crosstab(df: pd.DataFrame) -> Crosstab:
+    """同一个DataFrame上的所有题目共享一个引擎"""
+    key = id(df)
+    engine = _ENGINES.get(key)
+    if engine is None or engine.df is not df:
+        engine = Crosstab(df)
+        _ENGINES[key] = engine
+        weakref.finalize(df, _ENGINES.pop, key, None)
+    return engine
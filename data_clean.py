@@ -1,122 +1,431 @@
+import glob
+import hashlib
+import os
 import pandas as pd
 import numpy as np
+from typing import Iterator, List, Optional, Tuple
+from profiling import stage
+import derived
+import region
+import settings as settings_module
+from derived import derive
+from settings import CACHE_DIR, Settings, load_settings
 
-D_MAP_REGION = {
-    "天津‐天津市‐天津医科大学朱宪彝纪念医院(天津医科大学代谢病医院)": "北区"
-}
+# 参与清洗的源码文件，任一改动都会使缓存失效
+CLEAN_SOURCES = [
+    os.path.abspath(__file__),
+    os.path.abspath(derived.__file__),
+    os.path.abspath(region.__file__),
+    os.path.abspath(settings_module.__file__),
+]
 
-D_MAP_ITEM = {
-    "新诊断的患者每个都测，复诊患者固定频率测量（例如：一月一次）": "新诊每个都测，复诊固定频率",
-    "只有当患者主诉有贫血相关症状时或当CKD有进展时测": "只当有症状或CKD进展时测",
-    "每个患者固定频率测量（例如：一月一次）": "每个患者固定频率",
-    "每个患者每次就诊都测": "每个患者每次就诊都测",
-}
+# 百分比字段，原始值为0-100
+PCT_COLS = [
+    "门诊患者中CKD占比",
+    "病房患者中CKD占比",
+    "门诊CKD患者中ND占比",
+    "病房CKD患者中ND占比",
+    "门诊ND-CKD患者中3-5期占比",
+    "病房ND-CKD患者中3-5期占比",
+    "Hb>110g/L的患者比例",
+    "Hb101-110g/L的患者比例",
+    "Hb91-100g/L的患者比例",
+    "Hb81-90g/L的患者比例",
+    "Hb≤80g/L的患者比例",
+    "HIF总体使用比例",
+]
 
+# 按IQR依次去除极端值的字段
+OUTLIER_COLS = ["门诊患者数", "病房患者数"]
 
-def drop_outlier(df: pd.DataFrame, col: str, iqr_index: float = 3) -> pd.DataFrame:
-    # 计算第一四分位数（Q1）和第三四分位数（Q3）
-    Q1 = df[col].quantile(0.25)
-    Q3 = df[col].quantile(0.75)
-
-    # 计算四分位数间距（IQR）
-    IQR = Q3 - Q1
-
-    # 定义上下限（通常为1.5倍的IQR）
-    lower_bound = Q1 - iqr_index * IQR
-    upper_bound = Q3 + iqr_index * IQR
-
-    # 去除极端值
-    df_filtered = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
-
-    # 找到被去除的值
-    df_outlier = df[~df.index.isin(df_filtered.index)]
-
-    print(f"根据[{col}]列去除极端值：")
-    print(df_outlier[["医院", "姓名", col]])
-
-    return df_filtered
-
-
-def clean_data(file_path: str) -> pd.DataFrame:
-    df = pd.read_excel(file_path)
-
-    # 去掉无用列
-    df.drop(["总分"], axis=1, inplace=True)
-
-    # 简化列名
-    df_q = pd.read_excel("设置.xlsx", sheet_name="题目映射")
-    df.rename(columns=df_q.set_index("原始列名")["简化列名"].to_dict(), inplace=True)
-
-    # 百分比字段转换为小数
-    for col in [
-        "门诊患者中CKD占比",
-        "病房患者中CKD占比",
-        "门诊CKD患者中ND占比",
-        "病房CKD患者中ND占比",
-        "门诊ND-CKD患者中3-5期占比",
-        "病房ND-CKD患者中3-5期占比",
-        "Hb>110g/L的患者比例",
-        "Hb101-110g/L的患者比例",
-        "Hb91-100g/L的患者比例",
-        "Hb81-90g/L的患者比例",
-        "Hb≤80g/L的患者比例",
-        "HIF总体使用比例",
-    ]:
-        df[col] = df[col] / 100
-
-    # 详细计算病人数相关
-    df["门诊+病房患者数"] = df["门诊患者数"] + df["病房患者数"]
-    df["门诊CKD患者数"] = df["门诊患者数"] * df["门诊患者中CKD占比"]
-    df["病房CKD患者数"] = df["病房患者数"] * df["病房患者中CKD占比"]
-    df["门诊+病房CKD患者数"] = df["门诊CKD患者数"] + df["病房CKD患者数"]
-    df["门诊+病房患者中CKD占比"] = df["门诊+病房CKD患者数"] / df["门诊+病房患者数"]
-    df["门诊ND-CKD患者数"] = df["门诊CKD患者数"] * df["门诊CKD患者中ND占比"]
-    df["病房ND-CKD患者数"] = df["病房CKD患者数"] * df["病房CKD患者中ND占比"]
-    df["门诊+病房ND-CKD患者数"] = df["门诊ND-CKD患者数"] + df["病房ND-CKD患者数"]
-    df["门诊+病房CKD患者中ND占比"] = (
-        df["门诊+病房ND-CKD患者数"] / df["门诊+病房CKD患者数"]
-    )
-    df["门诊ND-CKD1-2期患者数"] = df["门诊ND-CKD患者数"] * (
-        1 - df["门诊ND-CKD患者中3-5期占比"]
-    )
-    df["病房ND-CKD1-2期患者数"] = df["病房ND-CKD患者数"] * (
-        1 - df["病房ND-CKD患者中3-5期占比"]
-    )
-    df["门诊+病房ND-CKD1-2期患者数"] = (
-        df["门诊ND-CKD1-2期患者数"] + df["病房ND-CKD1-2期患者数"]
-    )
-    df["门诊+病房ND-CKD患者中1-2期占比"] = (
-        df["门诊+病房ND-CKD1-2期患者数"] / df["门诊+病房ND-CKD患者数"]
-    )
-    df["门诊ND-CKD3-5期患者数"] = (
-        df["门诊ND-CKD患者数"] * df["门诊ND-CKD患者中3-5期占比"]
-    )
-    df["病房ND-CKD3-5期患者数"] = (
-        df["病房ND-CKD患者数"] * df["病房ND-CKD患者中3-5期占比"]
-    )
-    df["门诊+病房ND-CKD3-5期患者数"] = (
-        df["门诊ND-CKD3-5期患者数"] + df["病房ND-CKD3-5期患者数"]
+
+def _quartiles(
+    values: np.ndarray, groups: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """每行每列对应的Q1、Q3，分组时取所在组的分位数，无分组值的行用全体分位数"""
+    df_values = pd.DataFrame(values)
+    q = df_values.quantile([0.25, 0.75]).to_numpy(dtype=float)
+    Q1 = np.broadcast_to(q[0], values.shape)
+    Q3 = np.broadcast_to(q[1], values.shape)
+    if groups is None:
+        return Q1, Q3
+
+    g = df_values.groupby(groups)
+    Q1_group = g.quantile(0.25).reindex(groups).to_numpy(dtype=float)
+    Q3_group = g.quantile(0.75).reindex(groups).to_numpy(dtype=float)
+    return (
+        np.where(np.isnan(Q1_group), Q1, Q1_group),
+        np.where(np.isnan(Q3_group), Q3, Q3_group),
     )
-    df["门诊+病房ND-CKD患者中3-5期占比"] = (
-        df["门诊+病房ND-CKD3-5期患者数"] / df["门诊+病房ND-CKD患者数"]
+
+
+def find_outliers(
+    df: pd.DataFrame,
+    cols: List[str],
+    iqr_index: float = 3,
+    by: Optional[str] = None,
+    sequential: bool = False,
+    id_cols: Optional[List[str]] = None,
+) -> Tuple[pd.Series, pd.DataFrame]:
+    """按IQR一次性识别多列极端值，返回保留行掩码和极端值明细
+
+    by: 按该列分组分别计算上下限，例如"大区"
+    sequential: 按cols顺序逐列去除，后一列的分位数只用前面保留下来的行，
+        与原先逐列调用drop_outlier的结果一致
+    """
+    values = df[cols].to_numpy(dtype=float, na_value=np.nan)
+    groups = df[by].to_numpy() if by else None
+
+    if sequential:
+        keep = np.ones(len(df), dtype=bool)
+        lower = np.empty_like(values)
+        upper = np.empty_like(values)
+        within = np.ones_like(values, dtype=bool)
+        for j, col in enumerate(cols):
+            Q1, Q3 = _quartiles(
+                values[keep, j : j + 1], groups[keep] if by else None
+            )
+            IQR = Q3[:, 0] - Q1[:, 0]
+            lower[keep, j] = Q1[:, 0] - iqr_index * IQR
+            upper[keep, j] = Q3[:, 0] + iqr_index * IQR
+            lower[~keep, j] = np.nan
+            upper[~keep, j] = np.nan
+            within[keep, j] = (values[keep, j] >= lower[keep, j]) & (
+                values[keep, j] <= upper[keep, j]
+            )
+            keep &= within[:, j]
+    else:
+        # 计算第一四分位数（Q1）和第三四分位数（Q3）及四分位数间距（IQR）
+        Q1, Q3 = _quartiles(values, groups)
+        IQR = Q3 - Q1
+
+        # 定义上下限（通常为1.5倍的IQR）
+        lower = Q1 - iqr_index * IQR
+        upper = Q3 + iqr_index * IQR
+        within = (values >= lower) & (values <= upper)
+        keep = within.all(axis=1)
+
+    rows, j = np.nonzero(~within)
+    id_cols = [c for c in (id_cols or ["医院", "姓名"]) if c in df.columns]
+    report = df[id_cols + ([by] if by else [])].iloc[rows].copy()
+    report["字段"] = np.array(cols, dtype=object)[j]
+    report["值"] = values[rows, j]
+    report["下限"] = lower[rows, j]
+    report["上限"] = upper[rows, j]
+
+    return pd.Series(keep, index=df.index), report
+
+
+def print_outliers(report: pd.DataFrame, cols: List[str]):
+    for col in cols:
+        print(f"根据[{col}]列去除极端值：")
+        print(report[report["字段"] == col].drop(columns="字段"))
+
+
+def outlier_mask(
+    df: pd.DataFrame, cols: List[str], iqr_index: float = 3
+) -> pd.Series:
+    """保留行的掩码，与依次对每列调用drop_outlier的结果一致"""
+    return find_outliers(df, cols, iqr_index, sequential=True)[0]
+
+
+def drop_outlier(df: pd.DataFrame, col: str, iqr_index: float = 3) -> pd.DataFrame:
+    keep, report = find_outliers(df, [col], iqr_index)
+    print_outliers(report, [col])
+    return df[keep]
+
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(file_path: str, settings_path: str = "设置.xlsx", extra: str = "") -> str:
+    """原始导出文件 + 设置文件 + 清洗代码三者共同决定缓存键"""
+    h = hashlib.sha256()
+    for p in [file_path, settings_path, *CLEAN_SOURCES]:
+        h.update(file_hash(p).encode())
+    h.update(extra.encode())
+    return h.hexdigest()[:16]
+
+
+def _cache_stem(file_path: str, cache_dir: str) -> str:
+    """文件名加绝对路径的哈希，不同目录下的同名导出文件各自缓存"""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    path_key = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{name}-{path_key}")
+
+
+def _restore_dtypes(df: pd.DataFrame, path: str) -> pd.DataFrame:
+    """读取Parquet时字符串列会推断为str类型，按写入时的记录还原为object，
+    使缓存命中与未命中得到相同的数据"""
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path).pandas_metadata or {}
+    for col in metadata.get("columns", []):
+        if col["numpy_type"] == "object" and col["name"] in df.columns:
+            if df[col["name"]].dtype != object:
+                df[col["name"]] = df[col["name"]].astype(object)
+    return df
+
+
+def load_cache(
+    file_path: str, key: str, cache_dir: str = CACHE_DIR, variant: str = "full"
+) -> Optional[pd.DataFrame]:
+    stem = f"{_cache_stem(file_path, cache_dir)}-{variant}-{key}"
+    if os.path.exists(f"{stem}.parquet"):
+        return _restore_dtypes(pd.read_parquet(f"{stem}.parquet"), f"{stem}.parquet")
+    if os.path.exists(f"{stem}.pkl"):
+        return pd.read_pickle(f"{stem}.pkl")
+    return None
+
+
+def save_cache(
+    df: pd.DataFrame,
+    file_path: str,
+    key: str,
+    cache_dir: str = CACHE_DIR,
+    variant: str = "full",
+) -> str:
+    """variant区分同一导出文件的不同清洗参数（衍生字段、紧凑类型），互不覆盖"""
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = f"{_cache_stem(file_path, cache_dir)}-{variant}"
+
+    # 同一导出文件、同一参数的旧缓存已失效，直接清理；其他进程可能同时在清理
+    for old in glob.glob(f"{glob.escape(stem)}-*.*"):
+        if old.endswith(".tmp"):
+            continue
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+
+    stem = f"{stem}-{key}"
+    tmp = f"{stem}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, f"{stem}.parquet")
+        return f"{stem}.parquet"
+    except Exception:
+        # 未安装pyarrow或存在混合类型列时退回pickle
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        df.to_pickle(tmp)
+        os.replace(tmp, f"{stem}.pkl")
+        return f"{stem}.pkl"
+
+
+def clean_data(
+    file_path: str,
+    settings_path: str = "设置.xlsx",
+    use_cache: bool = True,
+    cache_dir: str = CACHE_DIR,
+    derived_cols: Optional[List[str]] = None,
+    compact_memory: bool = False,
+) -> pd.DataFrame:
+    """derived_cols指定时只计算这些衍生字段及其依赖
+    compact_memory为True时返回分类类型、数值向下转换后的紧凑数据
+    """
+    with stage("clean_data", file=os.path.basename(file_path)):
+        if use_cache:
+            with stage("load_cache"):
+                options = repr((derived_cols, compact_memory))
+                key = fingerprint(file_path, settings_path, options)
+                variant = hashlib.sha256(options.encode()).hexdigest()[:8]
+                df = load_cache(file_path, key, cache_dir, variant)
+            if df is not None:
+                return df
+
+        df = _clean_data(file_path, settings_path, derived_cols)
+
+        if compact_memory:
+            with stage("compact"):
+                df = compact(df, settings_path)
+
+        if use_cache:
+            with stage("save_cache"):
+                save_cache(df, file_path, key, cache_dir, variant)
+
+        return df
+
+
+def transform(
+    df: pd.DataFrame,
+    settings: Settings,
+    derived_cols: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """逐行独立的清洗步骤，整表清洗和分块清洗共用"""
+    with stage("rename"):
+        # 去掉无用列
+        df.drop(["总分"], axis=1, inplace=True)
+
+        # 简化列名
+        df.rename(columns=settings.rename_map, inplace=True)
+
+    with stage("percentage"):
+        # 百分比字段转换为小数
+        for col in PCT_COLS:
+            df[col] = df[col] / 100
+
+    # 详细计算病人数相关，只计算需要的衍生字段
+    with stage("derived"):
+        df = derive(df, settings.derived_spec, derived_cols)
+
+    with stage("region"):
+        # 匹配内部架构
+        df["目标名称"] = settings.resolver.target_names(df["医院"])
+        df["大区"] = settings.resolver.resolve(df["医院"])
+
+    with stage("simplify_items"):
+        # 简化部分字段值的文本
+        for col, mapping in settings.item_maps.items():
+            df[col] = df[col].map(mapping).fillna("其他")
+
+    return df
+
+
+def compact(
+    df: pd.DataFrame,
+    settings_path: str = "设置.xlsx",
+    keep_cols: Optional[List[str]] = None,
+    downcast: bool = True,
+    max_categories: int = 50,
+) -> pd.DataFrame:
+    """压缩内存：选择题和拆分字段转为分类类型，数值向下转换，去掉未用到的原始列
+
+    keep_cols: 除设置中定义的题目和衍生字段外还需保留的列
+    """
+    before, n_cols = df.memory_usage(deep=True).sum(), df.shape[1]
+
+    settings = load_settings(settings_path)
+    used = set(settings.columns) | set(settings.derived_spec) | set(keep_cols or [])
+    used |= {"序号", "医院", "姓名", "目标名称", "大区"}
+    df = df[[col for col in df.columns if col in used]].copy()
+
+    categories = settings.categories()
+    for col in df.columns:
+        data = df[col]
+        if pd.api.types.is_numeric_dtype(data):
+            if downcast:
+                kind = "float" if pd.api.types.is_float_dtype(data) else "integer"
+                df[col] = pd.to_numeric(data, downcast=kind)
+            continue
+
+        if col not in categories and data.nunique() > min(
+            max_categories, len(data) // 2
+        ):
+            continue
+
+        # 设置中没有列出的值排在最后，避免被置为缺失
+        order = categories.get(col) or []
+        known = set(order)
+        seen = [v for v in data.dropna().unique() if v not in known]
+        df[col] = pd.Categorical(data, categories=order + sorted(seen, key=str))
+
+    after = df.memory_usage(deep=True).sum()
+    print(
+        f"内存占用：{before / 2**20:.1f}MB -> {after / 2**20:.1f}MB"
+        f"（{after / before:.0%}），去掉未使用的{n_cols - df.shape[1]}列"
     )
+    print(df.dtypes.astype(str).value_counts().to_string())
 
-    # 匹配内部架构
-    df_internal = pd.read_excel("设置.xlsx", sheet_name="内部架构")
-    df["目标名称"] = df["医院"].apply(lambda x: x.split("‐")[-1])
-    df["大区"] = df["目标名称"].map(df_internal.set_index("目标名称")["大区"])
-    df["大区"] = df["医院"].map(D_MAP_REGION).fillna(df["大区"])
+    return df
 
-    #  去除极端值
-    for col in ["门诊患者数", "病房患者数"]:
-        df = drop_outlier(df, col)
 
-    # 简化部分字段值的文本
-    df["Hb测量时机"] = df["Hb测量时机"].map(D_MAP_ITEM).fillna("其他")
+def read_export(file_path: str) -> pd.DataFrame:
+    if file_path.lower().endswith(".csv"):
+        return pd.read_csv(file_path)
+    return pd.read_excel(file_path)
+
+
+def _clean_data(
+    file_path: str,
+    settings_path: str = "设置.xlsx",
+    derived_cols: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    with stage("read_excel"):
+        df = read_export(file_path)
+
+    with stage("read_settings"):
+        settings = load_settings(settings_path)
+
+    df = transform(df, settings, derived_cols=derived_cols)
+
+    #  去除极端值
+    with stage("drop_outlier"):
+        keep, report = find_outliers(df, OUTLIER_COLS, sequential=True)
+        print_outliers(report, OUTLIER_COLS)
+        df = df[keep]
 
     return df
 
 
+def iter_export(
+    file_path: str, chunksize: int = 50000, usecols: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    """分块读取问卷星导出的csv/xlsx，每块的索引沿用全表行号"""
+    if file_path.lower().endswith(".csv"):
+        yield from pd.read_csv(file_path, chunksize=chunksize, usecols=usecols)
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = list(next(rows))
+        idx = [header.index(col) for col in usecols] if usecols else range(len(header))
+        columns = [header[i] for i in idx]
+
+        start, buffer = 0, []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            buffer.append([row[i] for i in idx])
+            if len(buffer) == chunksize:
+                yield pd.DataFrame(
+                    buffer, columns=columns, index=range(start, start + len(buffer))
+                )
+                start, buffer = start + len(buffer), []
+        if buffer:
+            yield pd.DataFrame(
+                buffer, columns=columns, index=range(start, start + len(buffer))
+            )
+    finally:
+        wb.close()
+
+
+def clean_data_chunks(
+    file_path: str,
+    settings_path: str = "设置.xlsx",
+    chunksize: int = 50000,
+    iqr_index: float = 3,
+) -> Iterator[pd.DataFrame]:
+    """分块清洗，峰值内存只与块大小有关，结果与clean_data逐行一致
+
+    极端值需要全表分位数，因此先只读取极端值字段算出保留行，再逐块清洗
+    """
+    settings = load_settings(settings_path)
+    raw_name = {v: k for k, v in settings.rename_map.items()}
+
+    df_outlier = pd.concat(
+        iter_export(
+            file_path, chunksize, usecols=[raw_name.get(c, c) for c in OUTLIER_COLS]
+        )
+    ).rename(columns=settings.rename_map)
+    keep = outlier_mask(df_outlier, OUTLIER_COLS, iqr_index).to_numpy()
+    print(f"根据{OUTLIER_COLS}列去除极端值：{(~keep).sum()}行")
+    del df_outlier
+
+    for chunk in iter_export(file_path, chunksize):
+        with stage("transform_chunk", rows=len(chunk)):
+            chunk = transform(chunk, settings)
+        yield chunk[keep[chunk.index.to_numpy()]]
+
+
 if __name__ == "__main__":
     df = clean_data("265857608_按文本_ND-CKD患者肾性贫血治疗观念调研_107_90.xlsx")
     df.to_excel("cleaned.xlsx", index=False)
@@ -0,0 +1,80 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from profiling import stage
+
+# 患者漏斗的衍生字段，字段名用反引号引用
+# 设置.xlsx中存在"衍生字段"表（列：字段名、表达式）时以表中定义为准
+DERIVED_COLUMNS = {
+    "门诊+病房患者数": "`门诊患者数` + `病房患者数`",
+    "门诊CKD患者数": "`门诊患者数` * `门诊患者中CKD占比`",
+    "病房CKD患者数": "`病房患者数` * `病房患者中CKD占比`",
+    "门诊+病房CKD患者数": "`门诊CKD患者数` + `病房CKD患者数`",
+    "门诊+病房患者中CKD占比": "`门诊+病房CKD患者数` / `门诊+病房患者数`",
+    "门诊ND-CKD患者数": "`门诊CKD患者数` * `门诊CKD患者中ND占比`",
+    "病房ND-CKD患者数": "`病房CKD患者数` * `病房CKD患者中ND占比`",
+    "门诊+病房ND-CKD患者数": "`门诊ND-CKD患者数` + `病房ND-CKD患者数`",
+    "门诊+病房CKD患者中ND占比": "`门诊+病房ND-CKD患者数` / `门诊+病房CKD患者数`",
+    "门诊ND-CKD1-2期患者数": "`门诊ND-CKD患者数` * (1 - `门诊ND-CKD患者中3-5期占比`)",
+    "病房ND-CKD1-2期患者数": "`病房ND-CKD患者数` * (1 - `病房ND-CKD患者中3-5期占比`)",
+    "门诊+病房ND-CKD1-2期患者数": "`门诊ND-CKD1-2期患者数` + `病房ND-CKD1-2期患者数`",
+    "门诊+病房ND-CKD患者中1-2期占比": "`门诊+病房ND-CKD1-2期患者数` / `门诊+病房ND-CKD患者数`",
+    "门诊ND-CKD3-5期患者数": "`门诊ND-CKD患者数` * `门诊ND-CKD患者中3-5期占比`",
+    "病房ND-CKD3-5期患者数": "`病房ND-CKD患者数` * `病房ND-CKD患者中3-5期占比`",
+    "门诊+病房ND-CKD3-5期患者数": "`门诊ND-CKD3-5期患者数` + `病房ND-CKD3-5期患者数`",
+    "门诊+病房ND-CKD患者中3-5期占比": "`门诊+病房ND-CKD3-5期患者数` / `门诊+病房ND-CKD患者数`",
+}
+
+RE_COLUMN = re.compile(r"`([^`]+)`")
+
+
+def dependencies(expr: str) -> List[str]:
+    return list(dict.fromkeys(RE_COLUMN.findall(expr)))
+
+
+def resolve(spec: Dict[str, str], columns: Optional[List[str]] = None) -> List[str]:
+    """所需字段及其依赖的拓扑顺序，columns为None时计算全部字段"""
+    order, visiting = [], set()
+
+    def visit(name: str):
+        if name not in spec or name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"衍生字段存在循环依赖：{name}")
+        visiting.add(name)
+        for dep in dependencies(spec[name]):
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in spec if columns is None else columns:
+        visit(name)
+    return order
+
+
+def evaluate_expr(df: pd.DataFrame, expr: str) -> pd.Series:
+    """整条表达式一次求值，安装numexpr时不产生中间数组"""
+    names = {col: f"_c{i}" for i, col in enumerate(dependencies(expr))}
+    local_dict = {
+        alias: df[col].to_numpy(dtype=float, na_value=np.nan)
+        for col, alias in names.items()
+    }
+    # 与逐列Series运算一致，0/0等得到NaN时不提示
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = pd.eval(
+            RE_COLUMN.sub(lambda m: names[m.group(1)], expr), local_dict=local_dict
+        )
+    return pd.Series(result, index=df.index)
+
+
+def derive(
+    df: pd.DataFrame,
+    spec: Optional[Dict[str, str]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    spec = DERIVED_COLUMNS if spec is None else spec
+    for name in resolve(spec, columns):
+        with stage(name, expr=spec[name]):
+            df[name] = evaluate_expr(df, spec[name])
+    return df
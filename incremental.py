@@ -0,0 +1,94 @@
+import pickle
+import pandas as pd
+from typing import List, Optional
+from data_clean import (
+    OUTLIER_COLS,
+    outlier_mask,
+    load_settings,
+    read_export,
+    transform,
+)
+
+
+class IncrementalSurvey:
+    """问卷回收期间的增量分析：每次刷新只清洗新增答卷，并增量更新各聚合器
+
+    极端值的IQR上下限依赖全部答卷，每次刷新都重新计算，
+    保留状态发生变化的答卷会从聚合器中补入或扣除，因此聚合器必须支持remove
+    """
+
+    def __init__(
+        self,
+        settings_path: str = "设置.xlsx",
+        aggregators: Optional[List] = None,
+        id_col: str = "序号",
+        iqr_index: float = 3,
+    ):
+        self.settings_path = settings_path
+        self.aggregators = aggregators or []
+        self.check_aggregators()
+        self.id_col = id_col
+        self.iqr_index = iqr_index
+        self.df_all = None  # 去极端值之前的全部已清洗答卷，索引为答卷标识
+        self.keep = None
+
+    def check_aggregators(self):
+        """不支持remove的聚合器（如NumericSketchAggregator）无法撤出答卷，登记时即报错"""
+        for aggregator in self.aggregators:
+            if not callable(getattr(aggregator, "remove", None)):
+                raise TypeError(
+                    f"{type(aggregator).__name__}不支持remove，不能用于增量分析；"
+                    "数值题请使用NumericAggregator"
+                )
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self.df_all[self.keep]
+
+    def respondent_keys(self, df_raw: pd.DataFrame) -> pd.Index:
+        """优先使用问卷星答卷序号，否则用整行哈希识别答卷"""
+        if self.id_col in df_raw.columns:
+            return pd.Index(df_raw[self.id_col])
+        return pd.Index(pd.util.hash_pandas_object(df_raw, index=False))
+
+    def refresh(self, file_path: str) -> pd.DataFrame:
+        # 聚合器列表可能在创建后被追加，更新任何状态之前再检查一次
+        self.check_aggregators()
+        df_raw = read_export(file_path)
+        df_raw.index = self.respondent_keys(df_raw)
+
+        if self.df_all is not None:
+            df_raw = df_raw[~df_raw.index.isin(self.df_all.index)]
+        print(f"新增答卷：{len(df_raw)}份")
+
+        df_new = transform(df_raw.copy(), load_settings(self.settings_path))
+        self.df_all = pd.concat([self.df_all, df_new]) if self.df_all is not None else df_new
+
+        keep = outlier_mask(self.df_all, OUTLIER_COLS, self.iqr_index)
+        keep_before = (
+            self.keep.reindex(keep.index, fill_value=False)
+            if self.keep is not None
+            else pd.Series(False, index=keep.index)
+        )
+        added = self.df_all[keep & ~keep_before]
+        removed = self.df_all[~keep & keep_before]
+        if len(removed):
+            print(f"极端值上下限变化，撤出{len(removed)}份原有答卷")
+
+        for aggregator in self.aggregators:
+            if len(added):
+                aggregator.update(added)
+            if len(removed):
+                aggregator.remove(removed)
+
+        self.keep = keep
+        return self.df
+
+    def save(self, state_path: str):
+        with open(state_path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(state_path: str) -> "IncrementalSurvey":
+        with open(state_path, "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,185 @@
+import os
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+from crosstab import choice_stats, multiple_choice_stats
+from data_clean import clean_data
+from stream import (
+    MultipleChoiceAggregator,
+    NumericSketchAggregator,
+    SingleChoiceAggregator,
+)
+
+Aggregator = Union[
+    SingleChoiceAggregator, MultipleChoiceAggregator, NumericSketchAggregator
+]
+
+
+def make_aggregators(
+    questions: Dict[str, str],
+    breakouts: List[str],
+    weights: Optional[Dict[str, Dict[str, float]]] = None,
+    edges: Optional[Dict[str, List[float]]] = None,
+) -> Dict[str, Aggregator]:
+    """questions: 简化列名→题型（单选、多选、数值填空），与analysis.read_questions一致"""
+    weights = weights or {}
+    edges = edges or {}
+    aggregators = {}
+    for q, qtype in questions.items():
+        if qtype == "单选":
+            aggregators[q] = SingleChoiceAggregator(q, breakouts, weights.get(q))
+        elif qtype == "多选":
+            aggregators[q] = MultipleChoiceAggregator(q, breakouts)
+        elif qtype == "数值填空":
+            aggregators[q] = NumericSketchAggregator(q, edges.get(q), breakouts)
+    return aggregators
+
+
+def _aggregate_file(
+    source: str,
+    file_path: str,
+    settings_path: str,
+    questions: Dict[str, str],
+    breakouts: List[str],
+    weights: Optional[Dict[str, Dict[str, float]]],
+    edges: Optional[Dict[str, List[float]]],
+    use_cache: bool,
+) -> Tuple[Dict, Dict[str, Aggregator]]:
+    """在工作进程中清洗一个导出文件并汇总为部分结果，只把计数和草图传回主进程"""
+    start = time.perf_counter()
+    df = clean_data(file_path, settings_path, use_cache=use_cache)
+    aggregators = make_aggregators(
+        {q: t for q, t in questions.items() if q in df.columns},
+        [col for col in breakouts if col in df.columns],
+        weights,
+        edges,
+    )
+    for aggregator in aggregators.values():
+        aggregator.update(df)
+
+    info = {
+        "来源": source,
+        "文件": os.path.abspath(file_path),
+        "行数": len(df),
+        "题目数": len(aggregators),
+        "耗时": round(time.perf_counter() - start, 3),
+        "进程": os.getpid(),
+    }
+    return info, aggregators
+
+
+class MultiFileResult:
+    """多个导出文件合并后的结果，保留每个文件的部分结果用于溯源
+
+    result["Hb测量时机"]           合并后的全国统计
+    result["Hb测量时机", "大区"]    合并后的分大区统计
+    result.by_source("Hb测量时机")  各文件分别统计，列为来源
+    result.sources                 每个文件的行数、耗时和处理进程
+    """
+
+    def __init__(self, partials: List[Tuple[Dict, Dict[str, Aggregator]]]):
+        self.sources = pd.DataFrame([info for info, _ in partials]).set_index("来源")
+        self.partials: Dict[str, Dict[str, Aggregator]] = {
+            info["来源"]: aggregators for info, aggregators in partials
+        }
+        self.aggregators: Dict[str, Aggregator] = {}
+        for aggregators in self.partials.values():
+            for q, aggregator in aggregators.items():
+                self.aggregators[q] = (
+                    self.aggregators[q].merge(aggregator)
+                    if q in self.aggregators
+                    else aggregator
+                )
+
+    def __getitem__(
+        self, key: Union[str, Tuple[str, Optional[str]]]
+    ) -> Union[pd.Series, pd.DataFrame]:
+        question, col_breakout = key if isinstance(key, tuple) else (key, None)
+        return self.aggregators[question].get_stats(col_breakout)
+
+    def coverage(self, question: str) -> List[str]:
+        """包含该题的来源，题目在部分问卷版本中缺失时合并结果只来自这些文件"""
+        return [s for s, parts in self.partials.items() if question in parts]
+
+    def by_source(self, question: str) -> pd.DataFrame:
+        """各来源分别统计，格式与按拆分统计相同，来源作为分组"""
+        parts = {s: self.partials[s][question] for s in self.coverage(question)}
+        combined = self.aggregators[question]
+
+        if isinstance(combined, SingleChoiceAggregator):
+            counts = pd.concat(
+                {s: p.get_counts() for s, p in parts.items()}, axis=1
+            ).fillna(0)
+            return choice_stats(combined.get_counts(), counts.astype(int))
+
+        if isinstance(combined, MultipleChoiceAggregator):
+            counts = pd.concat({s: p.counts[None] for s, p in parts.items()}, axis=1)
+            return multiple_choice_stats(
+                combined.counts[None],
+                combined.n[None],
+                counts.fillna(0).astype(int),
+                pd.Series({s: p.n[None] for s, p in parts.items()}),
+            )
+
+        stats = pd.DataFrame({s: p.get_stats() for s, p in parts.items()}).T
+        n = pd.Series({s: p.sketches[None].n for s, p in parts.items()})
+        stats.insert(0, "计数", n)
+        stats.index = stats.index + "\n(n=" + n.astype(str) + ")"
+        return stats
+
+
+def source_labels(files: List[str]) -> Dict[str, str]:
+    """来源名取相对于共同上级目录的路径（不含扩展名），同名文件放在不同目录也不会冲突"""
+    paths = [os.path.abspath(path) for path in files]
+    if len(set(paths)) < len(paths):
+        raise ValueError("文件列表中有重复的文件")
+    root = os.path.commonpath([os.path.dirname(p) for p in paths])
+    labels = {
+        os.path.splitext(os.path.relpath(abs_path, root))[0]: path
+        for abs_path, path in zip(paths, files)
+    }
+    if len(labels) < len(files):
+        raise ValueError("来源名重复（同目录下文件名只有扩展名不同），请用字典指定来源名")
+    return labels
+
+
+def aggregate_files(
+    files: Union[List[str], Dict[str, str]],
+    questions: Dict[str, str],
+    settings_path: str = "设置.xlsx",
+    breakouts: Optional[List[str]] = None,
+    weights: Optional[Dict[str, Dict[str, float]]] = None,
+    edges: Optional[Dict[str, List[float]]] = None,
+    workers: int = 1,
+    use_cache: bool = True,
+) -> MultiFileResult:
+    """在进程池中并行清洗、汇总多个导出文件（不同项目或不同期），再合并为一个结果
+
+    files: 文件路径列表（来源名取相对共同上级目录的路径），或 来源名→文件路径
+    每个工作进程只返回计数矩阵和数值题草图，在主进程按文件顺序合并
+    edges: 数值题直方图边界，给出后按这些边界分组的计数是精确的
+    """
+    if not isinstance(files, dict):
+        files = source_labels(files)
+    breakouts = ["大区"] if breakouts is None else breakouts
+    n = len(files)
+    args = (
+        list(files),
+        list(files.values()),
+        [settings_path] * n,
+        [questions] * n,
+        [breakouts] * n,
+        [weights] * n,
+        [edges] * n,
+        [use_cache] * n,
+    )
+
+    start = time.perf_counter()
+    if workers <= 1 or n <= 1:
+        partials = list(map(_aggregate_file, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, n)) as pool:
+            partials = list(pool.map(_aggregate_file, *args))
+    print(f"汇总{n}个文件，用时{time.perf_counter() - start:.2f}秒")
+    return MultiFileResult(partials)
@@ -3,11 +3,12 @@ import sys
 import pandas as pd
 
 sys.path.append(path.abspath("../chart_class"))
-from figure import GridFigure
 from ppt import PPT, SlideContent
 from pptx.util import Inches, Pt, Cm
-from typing import List, Union, Optional
-import matplotlib.pyplot as plt
+from typing import Callable, List, Tuple, Union, Optional
+from crosstab import describe_numeric
+from render import CHART_CACHE_DIR, ChartCache, FigureSpec, render_figures
+from profiling import profiled, stage
 from wjx import ResultNumericValue, ResultSingleChoice, ResultMultipleChoice
 from data_clean import clean_data
 
@@ -34,12 +35,91 @@ D_BREAKOUT = {"大区": ["东1区", "东2区", "中区", "北区", "南区", "
 D_LAYOUT = {6: (3, 2)}
 
 
+# 推迟绘制的图表在形状树中的占位元素，python-pptx遍历形状时会跳过未知元素
+DEFERRED_TAG = "{urn:wjx:deferred}chart"
+
+
+def _shape_tree(slide: SlideContent):
+    """SlideContent所在幻灯片的形状树（p:spTree）"""
+    return getattr(slide, "slide", slide).shapes._spTree
+
+
+def breakout_layout(n: int) -> Tuple[int, int]:
+    """分组数对应的子图行列数，D_LAYOUT中没有的按两列排布"""
+    if n in D_LAYOUT:
+        return D_LAYOUT[n]
+    ncols = 1 if n == 1 else 2
+    return -(-n // ncols), ncols
+
+
 class PPT_survey(PPT):
 
+    def __init__(
+        self,
+        *args,
+        df: Optional[pd.DataFrame] = None,
+        workers: int = 1,
+        use_cache: bool = True,
+        cache_dir: str = CHART_CACHE_DIR,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        # 门诊/病房等直接按列名取数的页面使用的清洗后数据
+        self.df = df
+        self.workers = workers
+        # 数据和样式不变的图表直接复用上次绘制的图片
+        self.chart_cache = ChartCache(cache_dir) if use_cache else None
+        self._pending = []
+
+    def defer(self, slide: SlideContent, specs: List[FigureSpec], assemble: Callable):
+        """workers>1时先收集图表，保存前统一并行绘制，再按原顺序拼装幻灯片
+
+        推迟时在幻灯片形状树中放一个占位元素，拼装出的形状移到占位处，
+        调用方之后再添加的形状仍位于图表之上，形状顺序与串行生成一致
+        """
+        if self.workers > 1:
+            tree = _shape_tree(slide)
+            placeholder = tree.makeelement(DEFERRED_TAG, {})
+            # 与python-pptx添加形状相同，放在p:extLst之前
+            tree.insert_element_before(placeholder, "p:extLst")
+            self._pending.append((tree, placeholder, specs, assemble))
+        else:
+            images = render_figures(specs, cache=self.chart_cache)
+            with stage("assemble_slide"):
+                assemble(*images)
+
+    def render_pending(self):
+        specs = [spec for _, _, specs, _ in self._pending for spec in specs]
+        images = iter(
+            render_figures(specs, workers=self.workers, cache=self.chart_cache)
+        )
+        for tree, placeholder, specs, assemble in self._pending:
+            # 新形状不一定追加在末尾（形状树以p:extLst结尾时插在它之前），按集合差找出
+            before = set(tree)
+            with stage("assemble_slide"):
+                assemble(*[next(images) for _ in specs])
+            added = [element for element in tree if element not in before]
+            for element in added:
+                tree.remove(element)
+            position = list(tree).index(placeholder)
+            for offset, element in enumerate(added):
+                tree.insert(position + offset, element)
+            tree.remove(placeholder)
+        self._pending = []
+
+    def save(self, *args, **kwargs):
+        self.render_pending()
+        if self.chart_cache:
+            with stage("chart_cache_evict"):
+                self.chart_cache.evict()
+        with stage("save_pptx"):
+            return super().save(*args, **kwargs)
+
+    @profiled("slide.add_content_standard")
     def add_content_standard(
         self,
         result: Union[ResultSingleChoice, ResultMultipleChoice, ResultNumericValue],
-        col_breakout: Optional[str] = None,
+        col_breakout: Union[str, List[str], None] = None,
         width: float = 8,
         height: float = 6,
         fontsize: float = 12,
@@ -47,8 +127,10 @@ class PPT_survey(PPT):
         c = self.add_content_slide()
         c.set_title(result.col_question)
 
-        f = plt.figure(
-            FigureClass=GridFigure,
+        # 加权平均已在交叉表引擎中记忆，这里每张图只取一次
+        wavg = result.weighted_avg()
+
+        f = FigureSpec(
             width=width,
             height=height,
             fontsize=fontsize,
@@ -65,37 +147,34 @@ class PPT_survey(PPT):
             style={
                 "remove_xticks": True,
                 "show_legend": False,
-                "xlabel": (
-                    f"加权平均：{result.weighted_avg():.1%}"
-                    if result.weighted_avg()
-                    else None
-                ),
+                "xlabel": f"加权平均：{wavg:.1%}" if wavg else None,
             },
             label_threshold=0,
         )
-
-        c.add_image(
-            f.save(),
-            width=c.body.width / 2 * 0.9,
-            loc=c.body.fraction(dimension="width", frac_n=2, index=1).center,
-        )
+        specs = [f]
 
         if col_breakout:
-            f = plt.figure(
-                FigureClass=GridFigure,
+            df = result.get_stats(col_breakout=col_breakout)
+            nrows, ncols = breakout_layout(len(result.get_n(col_breakout)))
+            title = (
+                "×".join(col_breakout)
+                if isinstance(col_breakout, (list, tuple))
+                else col_breakout
+            )
+            f = FigureSpec(
                 width=8,
                 height=6,
                 sharex=True,
-                nrows=D_LAYOUT.get(len(D_BREAKOUT[col_breakout]))[0],
-                ncols=D_LAYOUT.get(len(D_BREAKOUT[col_breakout]))[1],
+                nrows=nrows,
+                ncols=ncols,
                 fontsize=fontsize - 1,
                 style={
-                    "title": f"{result.col_question} - 分{col_breakout}\n({result.qtype}, n={result.valid_n})",
+                    "title": f"{result.col_question} - 分{title}\n({result.qtype}, n={result.valid_n})",
                     "label_outer": True,
                 },
             )
 
-            df = result.get_stats(col_breakout=col_breakout)
+            wavg_breakout = result.weighted_avg(col_breakout=col_breakout)
             for i, bk in enumerate(df.columns):
                 f.plot(
                     kind="barh",
@@ -107,22 +186,28 @@ class PPT_survey(PPT):
                         "remove_xticks": True,
                         "show_legend": False,
                         "xlabel": (
-                            f"加权平均：{result.weighted_avg(col_breakout=bk).loc[bk]:.1%}"
-                            if result.weighted_avg(col_breakout=bk)
+                            f"加权平均：{wavg_breakout.loc[bk]:.1%}"
+                            if wavg_breakout is not None
                             else None
                         ),
                     },
                     label_threshold=0,
                 )
+            specs.append(f)
+
+        def assemble(*images):
+            for i, image in enumerate(images):
+                c.add_image(
+                    image,
+                    width=c.body.width / 2 * 0.9,
+                    loc=c.body.fraction(dimension="width", frac_n=2, index=i + 1).center,
+                )
 
-            c.add_image(
-                f.save(),
-                width=c.body.width / 2 * 0.9,
-                loc=c.body.fraction(dimension="width", frac_n=2, index=2).center,
-            )
+        self.defer(c, specs, assemble)
 
         return c
 
+    @profiled("slide.add_content_slide_in_and_out")
     def add_content_slide_in_and_out(
         self,
         col_name: str,
@@ -150,26 +235,24 @@ class PPT_survey(PPT):
                 title = f"门诊/病房{col_name} - 全国"
             c.set_title(title)
 
-            patients_n = ResultNumericValue(df, f"门诊+病房{col_name}")
+            valid_n = self.df[f"门诊+病房{col_name}"].count()
 
-            f = plt.figure(
-                FigureClass=GridFigure,
+            f = FigureSpec(
                 width=15,
                 height=6,
                 ncols=3,
                 nrows=2 if "占比" in col_name else 1,
                 fontsize=12,
                 style={
-                    "title": f"{title}\n({patients_n.qtype}, n={patients_n.valid_n})",
+                    "title": f"{title}\n(数值填空, n={valid_n})",
                     # "label_outer": True,
                 },
             )
 
             for i, source in enumerate(["门诊", "病房", "门诊+病房"]):
-                patients_n = ResultNumericValue(df, f"{source}{col_name}")
                 f.plot(
                     kind="hist",
-                    data=patients_n.data,
+                    data=self.df[f"{source}{col_name}"],
                     ax_index=i,
                     fmt="{:.1%}" if "占比" in col_name else "{:.0f}",
                     style={
@@ -185,10 +268,9 @@ class PPT_survey(PPT):
                 )
 
                 if "占比" in col_name:
-                    patients_n = ResultNumericValue(df, f"{source}{d_map[col_name]}")
                     f.plot(
                         kind="hist",
-                        data=patients_n.data,
+                        data=self.df[f"{source}{d_map[col_name]}"],
                         ax_index=i + 3,
                         style={
                             "ylabel": "频数",
@@ -208,25 +290,38 @@ class PPT_survey(PPT):
                 title = f"门诊/病房{col_name} - 分{breakout}"
             c.set_title(title)
 
-            patients_n = ResultNumericValue(df, f"门诊+病房{col_name}")
-            f = plt.figure(
-                FigureClass=GridFigure,
+            # 所有来源、所有字段的分组统计一次算出
+            names = [col_name, d_map[col_name]] if "占比" in col_name else [col_name]
+            cols = [f"{source}{name}" for name in names for source in DICT_COLOR_BY_SOURCE]
+            desc = describe_numeric(self.df, cols, breakout)
+
+            def means(col: str) -> pd.Series:
+                stats = desc.loc[col]
+                return pd.Series(
+                    stats["平均值"].to_numpy(),
+                    index=stats.index.astype(str)
+                    + "\n(n="
+                    + stats["计数"].astype(str)
+                    + ")",
+                )
+
+            valid_n = self.df[f"门诊+病房{col_name}"].count()
+            f = FigureSpec(
                 width=15,
                 height=6,
                 ncols=3,
                 nrows=2 if "占比" in col_name else 1,
                 fontsize=11,
                 style={
-                    "title": f"{title}\n({patients_n.qtype}, n={patients_n.valid_n})",
+                    "title": f"{title}\n(数值填空, n={valid_n})",
                     # "label_outer": True,
                 },
             )
 
             for i, source in enumerate(["门诊", "病房", "门诊+病房"]):
-                patients_n = ResultNumericValue(df, f"{source}{col_name}")
                 f.plot(
                     kind="bar",
-                    data=patients_n.get_stats(col_breakout="大区"),
+                    data=means(f"{source}{col_name}"),
                     ax_index=i,
                     fmt="{:.1%}" if "占比" in col_name else "{:.0f}",
                     style={
@@ -239,10 +334,9 @@ class PPT_survey(PPT):
                 )
 
                 if "占比" in col_name:
-                    patients_n = ResultNumericValue(df, f"{source}{d_map[col_name]}")
                     f.plot(
                         kind="bar",
-                        data=patients_n.get_stats(col_breakout="大区"),
+                        data=means(f"{source}{d_map[col_name]}"),
                         ax_index=i + 3,
                         style={
                             "ylabel": f"{d_map[col_name]}（平均值)",
@@ -253,14 +347,17 @@ class PPT_survey(PPT):
                         color_bar=DICT_COLOR_BY_SOURCE[source],
                     )
 
-        c.add_image(
-            f.save(),
-            width=c.body.width * 0.9,
-            height=None,
-            loc=c.body.center,
-        )
+        def assemble(image):
+            c.add_image(
+                image,
+                width=c.body.width * 0.9,
+                height=None,
+                loc=c.body.center,
+            )
 
-        self.add_question(c, d_map_question.get(col_name, ""))
+            self.add_question(c, d_map_question.get(col_name, ""))
+
+        self.defer(c, [f], assemble)
 
         return c
 
@@ -276,11 +373,18 @@ class PPT_survey(PPT):
         )
 
 
-if __name__ == "__main__":
-    df = clean_data("265857608_按文本_ND-CKD患者肾性贫血治疗观念调研_107_90.xlsx")
+def build_deck(
+    file_path: str,
+    settings_path: str = "设置.xlsx",
+    template: str = "template.pptx",
+    output: str = "test.pptx",
+    workers: int = 1,
+) -> str:
+    """由问卷星导出文件生成整份报告，返回pptx路径"""
+    df = clean_data(file_path, settings_path)
     print(df.columns)
 
-    p = PPT_survey("template.pptx")
+    p = PPT_survey(template, df=df, workers=workers)
 
     # """门诊病房患者数"""
     # p.add_content_slide_in_and_out("患者数")
@@ -598,4 +702,9 @@ if __name__ == "__main__":
     #     loc=c.body.center,
     # )
 
-    p.save("test.pptx")
+    p.save(output)
+    return output
+
+
+if __name__ == "__main__":
+    build_deck("265857608_按文本_ND-CKD患者肾性贫血治疗观念调研_107_90.xlsx")
@@ -0,0 +1,148 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+
+class Profiler:
+    """按阶段记录耗时和内存分配，阶段可以嵌套"""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records: List[Dict] = []
+        self._stack: List[Dict] = []
+
+    def _memory(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **meta):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # 外层阶段先记下目前为止的峰值，再为本阶段重置峰值
+        _, peak = self._memory()
+        for s in self._stack:
+            s["peak"] = max(s["peak"], peak)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        current, _ = self._memory()
+
+        s = {
+            "path": "/".join([x["path"] for x in self._stack[-1:]] + [name]),
+            "start": current,
+            "peak": current,
+        }
+        self._stack.append(s)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            current, peak = self._memory()
+            s["peak"] = max(s["peak"], peak)
+            self._stack.pop()
+            for outer in self._stack:
+                outer["peak"] = max(outer["peak"], s["peak"])
+
+            self.records.append(
+                {
+                    "stage": name,
+                    "path": s["path"],
+                    "seconds": elapsed,
+                    "peak_mb": (s["peak"] - s["start"]) / 2**20,
+                    "net_mb": (current - s["start"]) / 2**20,
+                    **meta,
+                }
+            )
+
+    def report(self) -> Dict:
+        summary = {}
+        for r in self.records:
+            item = summary.setdefault(
+                r["path"], {"calls": 0, "seconds": 0.0, "peak_mb": 0.0}
+            )
+            item["calls"] += 1
+            item["seconds"] += r["seconds"]
+            item["peak_mb"] = max(item["peak_mb"], r["peak_mb"])
+        return {"records": self.records, "summary": summary}
+
+    def summary(self) -> str:
+        summary = self.report()["summary"]
+        width = max([len(p) for p in summary] + [4])
+        lines = [f"{'阶段':<{width}}  {'次数':>8}  {'耗时(s)':>12}  {'峰值(MB)':>12}"]
+        for path, item in sorted(
+            summary.items(), key=lambda x: x[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                f"{path:<{width}}  {item['calls']:>8}  "
+                f"{item['seconds']:>12.3f}  {item['peak_mb']:>12.1f}"
+            )
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2, default=str)
+
+
+_PROFILER: Optional[Profiler] = None
+
+
+def enable(trace_memory: bool = True) -> Profiler:
+    global _PROFILER
+    _PROFILER = Profiler(trace_memory)
+    return _PROFILER
+
+
+def disable() -> Optional[Profiler]:
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler and profiler.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profiler
+
+
+def stage(name: str, **meta):
+    """未启用时不产生任何开销"""
+    if _PROFILER is None:
+        return contextlib.nullcontext()
+    return _PROFILER.stage(name, **meta)
+
+
+def profiled(name: str) -> Callable:
+    """方法级别的阶段记录，自动带上题目名"""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return func(*args, **kwargs)
+            meta = {}
+            if args and hasattr(args[0], "col_question"):
+                meta["question"] = args[0].col_question
+            if kwargs.get("col_breakout"):
+                meta["breakout"] = kwargs["col_breakout"]
+            with _PROFILER.stage(name, **meta):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _save_at_exit(path: str):
+    if _PROFILER is not None:
+        _PROFILER.save(path)
+        print(_PROFILER.summary())
+
+
+# 设置环境变量WJX_PROFILE=报告路径.json即可在进程退出时输出报告
+if os.environ.get("WJX_PROFILE"):
+    enable()
+    atexit.register(_save_at_exit, os.environ["WJX_PROFILE"])
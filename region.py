@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+
+def digits(text: str) -> List[str]:
+    return re.findall(r"\d+", str(text))
+
+
+def ngrams(text: str, n: int = 2) -> List[str]:
+    text = str(text)
+    if len(text) <= n:
+        return [text]
+    return [text[i : i + n] for i in range(len(text) - n + 1)]
+
+
+class RegionResolver:
+    """由内部架构表构建一次的 医院→大区 解析器
+
+    医院字段形如"省‐市‐医院名"，取最后一段与内部架构的目标名称精确匹配；
+    匹配不上的医院名通过字符n-gram索引找最相近的目标名称（Dice系数）。
+    近似匹配默认只作为建议（见suggestions），确认后加入overrides；
+    auto_fuzzy为True时才直接采用。名称中数字不同的视为不同医院，不作为候选。
+    每个不同的医院名只解析一次，结果可缓存到磁盘供下次运行复用
+    """
+
+    def __init__(
+        self,
+        region_map: pd.Series,
+        overrides: Optional[Dict[str, str]] = None,
+        threshold: float = 0.8,
+        n: int = 2,
+        cache_path: Optional[str] = None,
+        auto_fuzzy: bool = False,
+    ):
+        self.exact = region_map.to_dict()
+        self.overrides = overrides or {}
+        self.threshold = threshold
+        self.n = n
+        self.auto_fuzzy = auto_fuzzy
+        self.cache_path = cache_path
+
+        self.targets = list(self.exact.keys())
+        self.target_grams = [Counter(ngrams(t, n)) for t in self.targets]
+        self.index = defaultdict(list)
+        for i, grams in enumerate(self.target_grams):
+            for gram in grams:
+                self.index[gram].append(i)
+
+        self.key = hashlib.sha256(
+            json.dumps(
+                [
+                    sorted(self.exact.items()),
+                    sorted(self.overrides.items()),
+                    threshold,
+                    n,
+                    auto_fuzzy,
+                ],
+                ensure_ascii=False,
+                default=str,
+            ).encode()
+        ).hexdigest()[:16]
+        self.cache: Dict[str, Tuple[Optional[str], str]] = self._load_cache()
+        self._dirty = False
+
+    def _load_cache(self) -> Dict[str, Tuple[Optional[str], str]]:
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, encoding="utf-8") as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                # 缓存损坏时视为空缓存，重新解析
+                return {}
+            # 内部架构或参数变化后旧缓存作废
+            if cached.get("key") == self.key:
+                return {k: tuple(v) for k, v in cached["mapping"].items()}
+        return {}
+
+    def save_cache(self):
+        if not (self.cache_path and self._dirty):
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        # 多个工作进程可能同时读写，先写临时文件再原子替换
+        tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"key": self.key, "mapping": self.cache}, f, ensure_ascii=False
+            )
+        os.replace(tmp, self.cache_path)
+        self._dirty = False
+
+    def closest(self, name: str) -> Tuple[Optional[str], float]:
+        """n-gram倒排索引上的近似匹配，只对有共同n-gram的目标名称打分"""
+        grams = Counter(ngrams(name, self.n))
+        common = Counter()
+        for gram, count in grams.items():
+            for i in self.index.get(gram, []):
+                common[i] += min(count, self.target_grams[i][gram])
+        if not common:
+            return None, 0.0
+
+        size = sum(grams.values())
+        scores = sorted(
+            (
+                (2 * c / (size + sum(self.target_grams[i].values())), i)
+                for i, c in common.items()
+            ),
+            reverse=True,
+        )
+        # 并列最高分时无法判断，视为未匹配
+        if len(scores) > 1 and scores[0][0] == scores[1][0]:
+            return None, scores[0][0]
+        score, i = scores[0]
+        return self.targets[i], score
+
+    def resolve_one(self, hospital: str) -> Tuple[Optional[str], str]:
+        if hospital in self.overrides:
+            return self.overrides[hospital], "override"
+
+        target = str(hospital).split("‐")[-1]
+        if target in self.exact:
+            return self.exact[target], "exact"
+
+        closest, score = self.closest(target)
+        if (
+            closest is not None
+            and score >= self.threshold
+            and digits(closest) == digits(target)
+        ):
+            if self.auto_fuzzy:
+                return self.exact[closest], f"fuzzy:{closest}:{score:.2f}"
+            return None, f"suggest:{closest}:{score:.2f}"
+        return None, "unmatched"
+
+    def target_names(self, hospitals: pd.Series) -> pd.Series:
+        return hospitals.str.rsplit("‐", n=1).str[-1]
+
+    def resolve(self, hospitals: pd.Series) -> pd.Series:
+        codes, uniques = pd.factorize(hospitals)
+
+        new = [h for h in uniques if h not in self.cache]
+        for h in new:
+            self.cache[h] = self.resolve_one(h)
+        if new:
+            self._dirty = True
+            self.save_cache()
+
+        results = [self.cache[h] for h in uniques]
+        fuzzy = [(h, m) for h, (_, m) in zip(uniques, results) if m.startswith("fuzzy")]
+        suggested = [
+            (h, m) for h, (_, m) in zip(uniques, results) if m.startswith("suggest")
+        ]
+        unmatched = [h for h, (_, m) in zip(uniques, results) if m == "unmatched"]
+        if fuzzy:
+            print(f"以下{len(fuzzy)}家医院按名称近似匹配大区：")
+            for h, m in fuzzy:
+                print(f"  {h} -> {m.split(':', 1)[1]}")
+        if suggested:
+            print(f"以下{len(suggested)}家医院未匹配大区，有近似名称，确认后加入D_MAP_REGION：")
+            for h, m in suggested:
+                print(f"  {h} -> {m.split(':', 1)[1]}")
+        if unmatched:
+            print(f"以下{len(unmatched)}家医院未能匹配大区：{unmatched}")
+
+        regions = np.array(
+            [np.nan if r is None else r for r, _ in results] + [np.nan], dtype=object
+        )
+        return pd.Series(regions[codes], index=hospitals.index, dtype=object)
+
+    def suggestions(self) -> pd.DataFrame:
+        """已解析过的医院中待人工确认的近似匹配"""
+        rows = []
+        for h, (_, m) in self.cache.items():
+            if m.startswith("suggest"):
+                name, score = m.split(":", 1)[1].rsplit(":", 1)
+                rows.append([h, name, float(score), self.exact[name]])
+        return pd.DataFrame(rows, columns=["医院", "建议目标名称", "相似度", "建议大区"])
@@ -0,0 +1,203 @@
+from os import path
+import glob
+import hashlib
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+# 已绘制图表的缓存目录
+CHART_CACHE_DIR = path.join(".wjx_cache", "charts")
+
+
+class FigureSpec:
+    """记录GridFigure的参数和plot调用，可pickle后交给子进程绘制"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.plots = []
+
+    def plot(self, **kwargs):
+        self.plots.append(kwargs)
+
+
+def _feed(h, obj):
+    """把图表参数按内容写入哈希，DataFrame等按数值而不是对象身份"""
+    h.update(type(obj).__name__.encode())
+    if isinstance(obj, dict):
+        for k in sorted(obj, key=str):
+            _feed(h, k)
+            _feed(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(str(len(obj)).encode())
+        for x in obj:
+            _feed(h, x)
+    elif isinstance(obj, (pd.Series, pd.DataFrame)):
+        names = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+        _feed(h, [names, list(obj.index.names), str(obj.dtypes)])
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Index):
+        _feed(h, obj.to_series())
+    elif isinstance(obj, np.ndarray) and obj.dtype != object:
+        h.update(f"{obj.dtype}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, np.ndarray):
+        _feed(h, obj.tolist())
+    else:
+        h.update(repr(obj).encode())
+
+
+_BACKEND = None
+
+
+def plotting_backend():
+    """首次绘图时才导入matplotlib和GridFigure，只取统计结果时不承担这部分导入开销"""
+    global _BACKEND
+    if _BACKEND is None:
+        sys.path.append(path.abspath("../chart_class"))
+        import matplotlib.pyplot as plt
+        from figure import GridFigure
+
+        _BACKEND = (plt, GridFigure)
+    return _BACKEND
+
+
+_RENDERER_VERSION = None
+
+
+def renderer_version() -> str:
+    """GridFigure源码和matplotlib版本，任一变化都会使缓存的图表失效"""
+    global _RENDERER_VERSION
+    if _RENDERER_VERSION is None:
+        import matplotlib
+
+        _, GridFigure = plotting_backend()
+        h = hashlib.sha256(str(matplotlib.__version__).encode())
+        source = getattr(sys.modules[GridFigure.__module__], "__file__", None)
+        if source and path.exists(source):
+            with open(source, "rb") as f:
+                h.update(f.read())
+        _RENDERER_VERSION = h.hexdigest()
+    return _RENDERER_VERSION
+
+
+def spec_key(spec: FigureSpec) -> str:
+    """由数据、图表类型、样式、尺寸和字号等全部参数得到的内容哈希"""
+    h = hashlib.sha256(renderer_version().encode())
+    _feed(h, [spec.kwargs, spec.plots])
+    return h.hexdigest()[:32]
+
+
+class ChartCache:
+    """按内容寻址的图表磁盘缓存，超出容量时淘汰最久未使用的图片
+
+    多个进程可以共用同一目录：图片先写临时文件再原子替换，
+    其他进程淘汰掉的文件按未命中处理
+    """
+
+    def __init__(self, cache_dir: str = CHART_CACHE_DIR, max_mb: float = 512):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 2**20
+        self.hits = 0
+        self.misses = 0
+        # 本次读写过的图片，淘汰时保留
+        self.used = set()
+
+    def get(self, key: str) -> Optional[str]:
+        found = [
+            p
+            for p in glob.glob(path.join(self.cache_dir, key + ".*"))
+            if not p.endswith(".tmp")
+        ]
+        try:
+            # 以修改时间记录最近使用
+            os.utime(found[0])
+        except (IndexError, FileNotFoundError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.add(key)
+        return found[0]
+
+    def put(self, key: str, image: str) -> str:
+        """复制绘制好的图片到缓存，返回缓存中的路径"""
+        if not (isinstance(image, str) and path.isfile(image)):
+            return image
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached = path.join(self.cache_dir, key + path.splitext(image)[1])
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        shutil.copyfile(image, tmp)
+        os.replace(tmp, cached)
+        self.used.add(key)
+        return cached
+
+    def evict(self, keep: Optional[List[str]] = None):
+        """超出容量时按最近使用时间淘汰；keep默认为本次用到的图片，不参与淘汰
+
+        每份报告保存时调用一次，不在每批绘制后扫描目录
+        """
+        keep = self.used if keep is None else set(keep)
+        files = []
+        for p in glob.glob(path.join(self.cache_dir, "*")):
+            if p.endswith(".tmp") or path.splitext(path.basename(p))[0] in keep:
+                continue
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in files)
+        for _, size, p in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def render_figure(spec: FigureSpec) -> str:
+    with stage("render_figure", plots=len(spec.plots)):
+        plt, GridFigure = plotting_backend()
+        f = plt.figure(FigureClass=GridFigure, **spec.kwargs)
+        for kwargs in spec.plots:
+            f.plot(**kwargs)
+
+        image = f.save()
+        plt.close(f)
+        return image
+
+
+def render_figures(
+    specs: List[FigureSpec], workers: int = 1, cache: Optional[ChartCache] = None
+) -> List[str]:
+    """按输入顺序返回图片，workers>1时在进程池中并行绘制
+
+    cache不为None时只绘制缓存中没有的图表，缓存读写都在主进程中完成；
+    淘汰由调用方在整份报告完成后调用cache.evict
+    """
+    images = [None] * len(specs)
+    keys = [spec_key(spec) for spec in specs] if cache else [None] * len(specs)
+    if cache:
+        with stage("chart_cache_lookup", figures=len(specs)):
+            images = [cache.get(key) for key in keys]
+    todo = [i for i, image in enumerate(images) if image is None]
+
+    if workers <= 1 or len(todo) <= 1:
+        rendered = [render_figure(specs[i]) for i in todo]
+    else:
+        # 子进程内的阶段不会回传，这里只记录整体耗时
+        with stage("render_figures", figures=len(todo), workers=workers):
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+                rendered = list(pool.map(render_figure, [specs[i] for i in todo]))
+
+    for i, image in zip(todo, rendered):
+        images[i] = cache.put(keys[i], image) if cache else image
+    return images
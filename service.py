@@ -0,0 +1,317 @@
+import argparse
+import base64
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# 任务的输入文件和生成的报告
+JOBS_DIR = ".wjx_jobs"
+
+# 任务完成后保留的秒数，超过后删除任务记录和任务目录
+JOB_TTL = 3600
+
+
+def _warm_up():
+    """工作进程启动时预先导入pandas、pptx以及延迟导入的matplotlib和GridFigure，
+    任务不再承担冷启动"""
+    import presentation  # noqa: F401
+    from render import plotting_backend, renderer_version
+
+    plotting_backend()
+    renderer_version()
+
+
+def _ping(_) -> int:
+    # 稍作停留，使进程池为每个预热任务各拉起一个进程而不是复用空闲进程
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def _run_job(
+    file_path: str, settings_path: str, template: str, output: str
+) -> Dict:
+    """在工作进程中生成一份报告，返回各阶段耗时"""
+    import profiling
+    from presentation import build_deck
+
+    profiler = profiling.enable(trace_memory=False)
+    start = time.perf_counter()
+    try:
+        build_deck(file_path, settings_path, template=template, output=output)
+    finally:
+        profiling.disable()
+    summary = profiler.report()["summary"]
+    return {
+        "pid": os.getpid(),
+        "seconds": time.perf_counter() - start,
+        "stages": {path: round(item["seconds"], 3) for path, item in summary.items()},
+    }
+
+
+class Job:
+    def __init__(self, job_dir: str, file_path: str, settings_path: str):
+        self.id = os.path.basename(job_dir)
+        self.dir = job_dir
+        self.file_path = file_path
+        self.settings_path = settings_path
+        self.output = os.path.join(job_dir, "report.pptx")
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.timing: Dict = {}
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "queued_seconds": (self.started or time.time()) - self.submitted,
+            "run_seconds": (
+                (self.finished or time.time()) - self.started if self.started else None
+            ),
+            **self.timing,
+        }
+
+
+class ReportService:
+    """常驻的报告生成服务：预热的进程池 + 有界任务队列
+
+    每个工作进程对应一个调度线程，调度线程从队列取出任务后交给进程池，
+    因此任务出队即开始运行，排队时间和运行时间可以分别统计
+    """
+
+    def __init__(
+        self,
+        template: str = "template.pptx",
+        workers: int = 2,
+        max_queue: int = 8,
+        jobs_dir: str = JOBS_DIR,
+        job_ttl: float = JOB_TTL,
+    ):
+        self.template = os.path.abspath(template)
+        self.workers = workers
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.job_ttl = job_ttl
+        self.jobs: Dict[str, Job] = {}
+        self._jobs_lock = threading.Lock()
+        self.queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_queue)
+
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_warm_up)
+        # 提前拉起全部工作进程，第一份报告也不用等导入
+        pids = set(self.pool.map(_ping, range(workers)))
+        print(f"已启动{len(pids)}个工作进程：{sorted(pids)}")
+
+        for i in range(workers):
+            threading.Thread(
+                target=self._dispatch, name=f"dispatch-{i}", daemon=True
+            ).start()
+
+    def _dispatch(self):
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.timing = self.pool.submit(
+                    _run_job, job.file_path, job.settings_path, self.template, job.output
+                ).result()
+                job.status = "done"
+            except Exception:
+                job.status = "failed"
+                job.error = traceback.format_exc()
+            job.finished = time.time()
+            job.done.set()
+            self.queue.task_done()
+            self.evict()
+
+    def evict(self) -> List[str]:
+        """删除完成超过job_ttl秒的任务及其目录，以及上次运行遗留的过期任务目录"""
+        deadline = time.time() - self.job_ttl
+        with self._jobs_lock:
+            expired = [
+                job_id
+                for job_id, job in self.jobs.items()
+                if job.finished is not None and job.finished < deadline
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
+            tracked = set(self.jobs)
+
+        dirs = [os.path.join(self.jobs_dir, job_id) for job_id in expired]
+        if os.path.isdir(self.jobs_dir):
+            for entry in os.scandir(self.jobs_dir):
+                try:
+                    if entry.name not in tracked and entry.stat().st_mtime < deadline:
+                        dirs.append(entry.path)
+                except FileNotFoundError:
+                    continue
+        for job_dir in set(dirs):
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return expired
+
+    def submit(self, files: Dict[str, Dict[str, str]]) -> Job:
+        """files: export/settings → {"path": 本地路径} 或 {"name": 文件名, "data": base64内容}
+
+        请求格式错误时抛出KeyError/ValueError/TypeError，队列已满时抛出queue.Full，
+        两种情况都不会留下任务目录
+        """
+        # 先检查请求完整，再创建任务目录
+        items = {role: files[role] for role in ["export", "settings"]}
+        names = {}
+        for role, item in items.items():
+            if "path" in item:
+                continue
+            if not ("name" in item and "data" in item):
+                raise ValueError(f"{role}需要path，或name和data")
+            # 只取文件名，客户端传来的目录部分（包括Windows路径）一律丢弃
+            names[role] = os.path.basename(item["name"].replace("\\", "/"))
+            if names[role] in ("", ".", ".."):
+                raise ValueError(f"{role}的文件名无效：{item['name']!r}")
+        self.evict()
+
+        job_dir = os.path.join(self.jobs_dir, uuid.uuid4().hex[:12])
+        os.makedirs(job_dir)
+        try:
+            paths = {}
+            for role, item in items.items():
+                if "path" in item:
+                    paths[role] = os.path.abspath(item["path"])
+                else:
+                    # 按角色分目录保存，两个文件同名时不会互相覆盖
+                    os.makedirs(os.path.join(job_dir, role))
+                    paths[role] = os.path.join(job_dir, role, names[role])
+                    with open(paths[role], "wb") as f:
+                        f.write(base64.b64decode(item["data"], validate=True))
+
+            job = Job(job_dir, paths["export"], paths["settings"])
+            self.queue.put_nowait(job)
+        except BaseException:
+            # 解码失败、队列已满等情况下不留下空的任务目录
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+        return job
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """POST /jobs 提交任务（"wait": true时等待并直接返回pptx）
+    GET /jobs 全部任务，GET /jobs/<id> 任务状态，GET /jobs/<id>/report 下载报告
+    """
+
+    service: ReportService
+
+    def _json(self, code: int, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _report(self, job: Job):
+        if job.status != "done":
+            return self._json(409, job.to_dict())
+        try:
+            with open(job.output, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # 任务已过期被清理
+            return self._json(404, {"error": "报告已过期"})
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        )
+        self.send_header("Content-Disposition", f'attachment; filename="{job.id}.pptx"')
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._json(404, {"error": "not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            job = self.service.submit(body)
+        except queue.Full:
+            return self._json(503, {"error": "任务队列已满，请稍后重试"})
+        except (KeyError, ValueError, TypeError) as e:
+            return self._json(400, {"error": f"请求格式错误：{e!r}"})
+
+        if body.get("wait"):
+            job.done.wait()
+            if job.status != "done":
+                return self._json(500, job.to_dict())
+            return self._report(job)
+        self._json(202, job.to_dict())
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("/") if p]
+        if parts == ["jobs"]:
+            jobs = list(self.service.jobs.values())
+            return self._json(200, [job.to_dict() for job in jobs])
+        job = self.service.jobs.get(parts[1]) if len(parts) in (2, 3) else None
+        if parts[0:1] == ["jobs"] and job is not None:
+            if len(parts) == 2:
+                return self._json(200, job.to_dict())
+            if parts[2] == "report":
+                return self._report(job)
+        self._json(404, {"error": "not found"})
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    template: str = "template.pptx",
+    workers: int = 2,
+    max_queue: int = 8,
+    job_ttl: float = JOB_TTL,
+):
+    service = ReportService(
+        template, workers=workers, max_queue=max_queue, job_ttl=job_ttl
+    )
+    handler = type("BoundHandler", (Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"报告服务已启动：http://{host}:{port}/jobs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地报告生成服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--template", default="template.pptx")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=8)
+    parser.add_argument(
+        "--job-ttl", type=float, default=JOB_TTL, help="任务完成后保留的秒数"
+    )
+    args = parser.parse_args(argv)
+    serve(
+        args.host, args.port, args.template, args.workers, args.max_queue, args.job_ttl
+    )
+
+
+if __name__ == "__main__":
+    main()
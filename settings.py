@@ -0,0 +1,124 @@
+import hashlib
+import os
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from derived import DERIVED_COLUMNS
+from region import RegionResolver
+
+# 清洗结果、大区匹配等缓存目录
+CACHE_DIR = ".wjx_cache"
+
+D_MAP_REGION = {
+    "天津‐天津市‐天津医科大学朱宪彝纪念医院(天津医科大学代谢病医院)": "北区"
+}
+
+D_MAP_ITEM = {
+    "新诊断的患者每个都测，复诊患者固定频率测量（例如：一月一次）": "新诊每个都测，复诊固定频率",
+    "只有当患者主诉有贫血相关症状时或当CKD有进展时测": "只当有症状或CKD进展时测",
+    "每个患者固定频率测量（例如：一月一次）": "每个患者固定频率",
+    "每个患者每次就诊都测": "每个患者每次就诊都测",
+}
+
+
+class Settings:
+    """设置.xlsx编译后的查找表，所有工作表只读取一次
+
+    题目映射 → rename_map、question_types、options
+    内部架构 → resolver（医院→大区）、regions
+    衍生字段 → derived_spec，没有该表时使用默认定义
+    选项映射 → item_maps（列：字段名、原始选项、简化选项），没有该表时使用D_MAP_ITEM，
+        映射表中没有的选项统一简化为"其他"
+
+    只包含字典和列表，可以直接pickle发给子进程
+    """
+
+    def __init__(self, settings_path: str = "设置.xlsx", cache_dir: str = CACHE_DIR):
+        self.path = os.path.abspath(settings_path)
+        self.key = _file_hash(settings_path)
+
+        sheets = pd.read_excel(settings_path, sheet_name=None)
+        df_q = sheets["题目映射"]
+        df_internal = sheets["内部架构"]
+
+        self.rename_map: Dict[str, str] = df_q.set_index("原始列名")["简化列名"].to_dict()
+        self.columns: List[str] = list(df_q["简化列名"])
+        self.question_types: Optional[Dict[str, str]] = (
+            df_q.set_index("简化列名")["题型"].dropna().to_dict()
+            if "题型" in df_q.columns
+            else None
+        )
+        self.options: Dict[str, List[str]] = (
+            {
+                col: str(options).split("|")
+                for col, options in df_q.set_index("简化列名")["选项"].dropna().items()
+            }
+            if "选项" in df_q.columns
+            else {}
+        )
+
+        self.regions: List[str] = list(df_internal["大区"].dropna().unique())
+        self.resolver = RegionResolver(
+            df_internal.set_index("目标名称")["大区"],
+            overrides=D_MAP_REGION,
+            cache_path=os.path.join(cache_dir, "region_cache.json"),
+        )
+
+        if "衍生字段" in sheets:
+            self.derived_spec: Dict[str, str] = (
+                sheets["衍生字段"].set_index("字段名")["表达式"].to_dict()
+            )
+        else:
+            self.derived_spec = DERIVED_COLUMNS
+
+        if "选项映射" in sheets:
+            self.item_maps: Dict[str, Dict[str, str]] = {
+                col: g.set_index("原始选项")["简化选项"].to_dict()
+                for col, g in sheets["选项映射"].groupby("字段名", sort=False)
+            }
+        else:
+            self.item_maps = {"Hb测量时机": D_MAP_ITEM}
+
+    def categories(self) -> Dict[str, Optional[List]]:
+        """各选择题及拆分字段的类别顺序，None表示按数据中出现的值排序
+
+        题目映射中的"题型"列标记单选/多选，可选的"选项"列以|分隔给出选项顺序；
+        大区按内部架构中首次出现的顺序，简化过的字段按选项映射的顺序
+        """
+        categories = {"大区": self.regions, "医院": None, "目标名称": None}
+        for col, mapping in self.item_maps.items():
+            categories[col] = list(dict.fromkeys(mapping.values())) + ["其他"]
+        for col, qtype in (self.question_types or {}).items():
+            if qtype in ["单选", "多选"]:
+                categories.setdefault(col, None)
+        categories.update(self.options)
+        return categories
+
+
+def _file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# (绝对路径, 缓存目录) → ((修改时间, 文件大小), Settings)
+_SETTINGS: Dict[Tuple[str, str], Tuple[Tuple[int, int], Settings]] = {}
+
+
+def load_settings(
+    settings_path: str = "设置.xlsx", cache_dir: str = CACHE_DIR
+) -> Settings:
+    """同一设置文件只解析一次；修改时间变化但内容未变时也复用"""
+    key = (os.path.abspath(settings_path), cache_dir)
+    st = os.stat(settings_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    cached = _SETTINGS.get(key)
+    if cached is not None:
+        if cached[0] == stamp:
+            return cached[1]
+        if cached[1].key == _file_hash(settings_path):
+            _SETTINGS[key] = (stamp, cached[1])
+            return cached[1]
+
+    settings = Settings(settings_path, cache_dir)
+    _SETTINGS[key] = (stamp, settings)
+    return settings
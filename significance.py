@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+CORRECTIONS = ["bh", "bonferroni", "none"]
+
+
+def pad_tables(tables: List[np.ndarray]) -> np.ndarray:
+    """形状不同的列联表补0后叠成(表, 行, 列)数组，补出的行列合计为0不影响检验"""
+    rows = max(t.shape[0] for t in tables)
+    cols = max(t.shape[1] for t in tables)
+    stacked = np.zeros((len(tables), rows, cols))
+    for i, t in enumerate(tables):
+        stacked[i, : t.shape[0], : t.shape[1]] = t
+    return stacked
+
+
+def chi2_batch(
+    tables: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """一批列联表的卡方独立性检验，全部在一个三维数组上完成
+
+    返回卡方值、自由度、p值、Cramér's V，以及每张表偏离最大的单元格的调整残差数组
+    """
+    from scipy.stats import chi2
+
+    O = pad_tables(tables)
+    r = O.sum(axis=2, keepdims=True)
+    c = O.sum(axis=1, keepdims=True)
+    n = O.sum(axis=(1, 2), keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        E = r * c / n
+        stat = np.where(E > 0, (O - E) ** 2 / E, 0).sum(axis=(1, 2))
+        residuals = np.where(
+            E > 0, (O - E) / np.sqrt(E * (1 - r / n) * (1 - c / n)), 0
+        )
+
+    n_rows = (r[:, :, 0] > 0).sum(axis=1)
+    n_cols = (c[:, 0, :] > 0).sum(axis=1)
+    dof = (n_rows - 1) * (n_cols - 1)
+    n = n[:, 0, 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.where(dof > 0, chi2.sf(stat, np.maximum(dof, 1)), np.nan)
+        v = np.sqrt(stat / (n * (np.minimum(n_rows, n_cols) - 1)))
+    return stat, dof, p, v, np.nan_to_num(residuals, posinf=0, neginf=0)
+
+
+def adjust_pvalues(p: np.ndarray, method: str = "bh") -> np.ndarray:
+    """多重比较校正：bh为Benjamini-Hochberg（控制FDR），bonferroni控制总体一类错误"""
+    if method not in CORRECTIONS:
+        raise ValueError(f"未知的校正方法：{method}，可选{CORRECTIONS}")
+    p = np.asarray(p, dtype=float)
+    valid = ~np.isnan(p)
+    m = valid.sum()
+    adjusted = np.full_like(p, np.nan)
+    if method == "none":
+        adjusted[valid] = p[valid]
+    elif method == "bonferroni":
+        adjusted[valid] = np.minimum(p[valid] * m, 1)
+    else:
+        order = np.argsort(p[valid])
+        ranked = p[valid][order] * m / np.arange(1, m + 1)
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        values = np.empty(m)
+        values[order] = np.minimum(ranked, 1)
+        adjusted[valid] = values
+    return adjusted
+
+
+def significance_table(
+    tables: List[Tuple[dict, pd.DataFrame]],
+    method: str = "bh",
+    alpha: float = 0.05,
+    only_significant: bool = True,
+) -> pd.DataFrame:
+    """tables: (描述字段, 行×分组计数表)列表，按校正后p值和效应量排序
+
+    "最大偏离"给出调整残差绝对值最大的单元格，即差异主要来自哪个分组的哪个选项
+    """
+    columns = [
+        "卡方", "自由度", "p值", "校正p值", "Cramér's V", "最大偏离", "调整残差", "显著"
+    ]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+
+    stat, dof, p, v, residuals = chi2_batch([t.to_numpy() for _, t in tables])
+    adjusted = adjust_pvalues(p, method)
+
+    rows = []
+    for i, (meta, t) in enumerate(tables):
+        # 逐选项检验的表两行残差互为相反数，只看选中的一行
+        n_rows = 1 if meta.get("选项") is not None else t.shape[0]
+        res = residuals[i, :n_rows, : t.shape[1]]
+        j, k = np.unravel_index(np.abs(res).argmax(), res.shape)
+        rows.append(
+            {
+                **meta,
+                "卡方": stat[i],
+                "自由度": dof[i],
+                "p值": p[i],
+                "校正p值": adjusted[i],
+                "Cramér's V": v[i],
+                "最大偏离": f"{t.columns[k]}：{t.index[j]}",
+                "调整残差": res[j, k],
+                "显著": adjusted[i] < alpha,
+            }
+        )
+
+    result = pd.DataFrame(rows).sort_values(
+        ["校正p值", "Cramér's V"], ascending=[True, False], na_position="last"
+    )
+    if only_significant:
+        result = result[result["显著"]]
+    return result.reset_index(drop=True)
+
+
+def choice_tables(
+    counts: pd.DataFrame, n: Optional[pd.Series] = None
+) -> List[Tuple[Optional[str], pd.DataFrame]]:
+    """单选题整张 选项×分组 表做一次检验；多选题（给出各分组有效样本量n）
+    每个选项做一次 选中/未选中×分组 的比例检验
+    """
+    if n is None:
+        return [(None, counts)]
+    n = n.reindex(counts.columns).fillna(0)
+    return [
+        (item, pd.DataFrame([row, n - row], index=[item, f"未选{item}"]))
+        for item, row in counts.iterrows()
+    ]
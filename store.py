@@ -0,0 +1,204 @@
+import json
+import os
+import time
+import pandas as pd
+from typing import Dict, List, Optional, Union
+from data_clean import clean_data, file_hash
+from settings import load_settings
+from wjx import Result, ResultMultipleChoice, ResultNumericValue, ResultSingleChoice
+
+# 各期清洗结果的列式存储
+STORE_DIR = ".wjx_store"
+
+# 查询结果中标记期次的字段，可以作为拆分使用
+WAVE_COL = "期"
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """混合类型的object列转为字符串，缺失值保持为空，其他列不变"""
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].astype("string")
+    return df
+
+
+class SurveyStore:
+    """按 项目/期 分区的Parquet存储，每期一个文件：
+    store_dir/survey=<项目>/wave=<期>/data.parquet
+
+    manifest.json记录每期的行数、题目列、题型、来源文件及其哈希，
+    查询时先按清单定位包含该题的期，再只读取需要的列，不必重新清洗历史导出文件；
+    期按名称排序，建议使用2024Q1、2024-03这类可排序的名称
+    需要pyarrow
+    """
+
+    def __init__(self, store_dir: str = STORE_DIR):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, "manifest.json")
+        self.manifest: Dict[str, Dict[str, Dict]] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def _path(self, survey: str, wave: str) -> str:
+        return os.path.join(
+            self.store_dir, f"survey={survey}", f"wave={wave}", "data.parquet"
+        )
+
+    def _save_manifest(self):
+        tmp = f"{self.manifest_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def ingest(
+        self,
+        df: pd.DataFrame,
+        survey: str,
+        wave: str,
+        question_types: Optional[Dict[str, str]] = None,
+        source: Optional[str] = None,
+    ) -> str:
+        """写入一期已清洗的数据，同一项目同一期再次写入时覆盖"""
+        path = self._path(survey, wave)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            df.to_parquet(f"{path}.tmp", index=False)
+        except Exception:
+            _arrow_safe(df).to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+
+        self.manifest.setdefault(survey, {})[str(wave)] = {
+            "rows": len(df),
+            "columns": list(map(str, df.columns)),
+            "question_types": question_types or {},
+            "source": os.path.abspath(source) if source else None,
+            "source_hash": file_hash(source) if source else None,
+            "ingested": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._save_manifest()
+        print(f"已写入{survey}第{wave}期：{len(df)}行")
+        return path
+
+    def ingest_file(
+        self,
+        file_path: str,
+        survey: str,
+        wave: str,
+        settings_path: str = "设置.xlsx",
+        force: bool = False,
+    ) -> str:
+        """清洗导出文件后写入；来源文件未变化时跳过"""
+        entry = self.manifest.get(survey, {}).get(str(wave))
+        if (
+            not force
+            and entry is not None
+            and entry["source_hash"] == file_hash(file_path)
+            and os.path.exists(self._path(survey, wave))
+        ):
+            print(f"{survey}第{wave}期未变化，跳过")
+            return self._path(survey, wave)
+
+        df = clean_data(file_path, settings_path)
+        question_types = load_settings(settings_path).question_types
+        return self.ingest(df, survey, wave, question_types, source=file_path)
+
+    def waves(self, survey: Optional[str] = None) -> pd.DataFrame:
+        """期次清单，按项目、期排序"""
+        rows = [
+            {
+                "项目": s,
+                WAVE_COL: w,
+                "行数": e["rows"],
+                "题目数": len(e["columns"]),
+                "来源": e["source"],
+                "写入时间": e["ingested"],
+            }
+            for s, waves in self.manifest.items()
+            if survey is None or s == survey
+            for w, e in waves.items()
+        ]
+        columns = ["项目", WAVE_COL, "行数", "题目数", "来源", "写入时间"]
+        return pd.DataFrame(rows, columns=columns).sort_values(["项目", WAVE_COL])
+
+    def questions(self, survey: str) -> pd.DataFrame:
+        """题目×期 的覆盖情况，True表示该期包含此题"""
+        waves = self.manifest[survey]
+        columns = {w: pd.Series(True, index=e["columns"]) for w, e in waves.items()}
+        coverage = pd.DataFrame(columns).fillna(False).astype(bool)
+        return coverage[sorted(coverage.columns)]
+
+    def qtype(self, survey: str, question: str) -> Optional[str]:
+        """最近一期记录的题型"""
+        for wave in sorted(self.manifest[survey], reverse=True):
+            qtype = self.manifest[survey][wave]["question_types"].get(question)
+            if qtype:
+                return qtype
+        return None
+
+    def load(
+        self,
+        survey: str,
+        columns: Optional[List[str]] = None,
+        waves: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """读取多期数据并增加期次字段；columns指定时只读这些列，缺少某题的期跳过"""
+        entries = self.manifest[survey]
+        waves = sorted(entries) if waves is None else [str(w) for w in waves]
+
+        frames = {}
+        for wave in waves:
+            available = entries[wave]["columns"]
+            if columns is not None and not set(columns) <= set(available):
+                continue
+            frames[wave] = pd.read_parquet(self._path(survey, wave), columns=columns)
+        if not frames:
+            raise ValueError(f"{survey}没有同时包含{columns}的期")
+
+        df = pd.concat(frames, names=[WAVE_COL, None]).reset_index(level=0)
+        df[WAVE_COL] = pd.Categorical(df[WAVE_COL], categories=list(frames))
+        return df.reset_index(drop=True)
+
+    def result(
+        self,
+        survey: str,
+        question: str,
+        qtype: Optional[str] = None,
+        breakouts: Optional[List[str]] = None,
+        waves: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Result:
+        """多期合并的Result对象，以WAVE_COL作为拆分即得到逐期对比"""
+        qtype = qtype or self.qtype(survey, question) or "单选"
+        df = self.load(survey, [question, *(breakouts or [])], waves)
+        if qtype == "多选":
+            return ResultMultipleChoice(df, question, **kwargs)
+        if qtype == "数值填空":
+            return ResultNumericValue(df, question)
+        return ResultSingleChoice(df, question, **kwargs)
+
+    def trend(
+        self,
+        survey: str,
+        question: str,
+        qtype: Optional[str] = None,
+        col_breakout: Optional[str] = None,
+        waves: Optional[List[str]] = None,
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """逐期统计；给出col_breakout时为 期×分组 的对比"""
+        result = self.result(
+            survey, question, qtype, [col_breakout] if col_breakout else None, waves
+        )
+        if col_breakout is None:
+            return result.get_stats(WAVE_COL)
+        if isinstance(result, ResultNumericValue):
+            # 数值题的拆分只支持单个字段，逐期分别统计后拼接
+            return pd.concat(
+                {
+                    wave: ResultNumericValue(g, question).get_stats(col_breakout)
+                    for wave, g in result.df.groupby(WAVE_COL, observed=True)
+                },
+                names=[WAVE_COL, None],
+            )
+        return result.get_stats([WAVE_COL, col_breakout])
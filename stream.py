@@ -0,0 +1,295 @@
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Union
+from crosstab import (
+    Crosstab,
+    choice_stats,
+    indicator_matrix,
+    multiple_choice_stats,
+    weighted_avg_from_counts,
+)
+from data_clean import clean_data_chunks
+from render import plotting_backend
+from sketch import NumericSketch
+from wjx import ResultNumericValue
+
+
+def _add(
+    total: Optional[Union[pd.Series, pd.DataFrame]],
+    part: Union[pd.Series, pd.DataFrame],
+    sign: int = 1,
+) -> Union[pd.Series, pd.DataFrame]:
+    if total is None:
+        return part * sign
+    return total.add(part * sign, fill_value=0).fillna(0).astype(int)
+
+
+class SingleChoiceAggregator:
+    """逐块累加单选题计数，统计结果与ResultSingleChoice一致"""
+
+    def __init__(
+        self,
+        col_question: str,
+        col_breakouts: Optional[List[str]] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.col_question = col_question
+        self.col_breakouts = col_breakouts or []
+        self.weights = weights
+        self.counts = {}
+
+    def update(self, chunk: pd.DataFrame, sign: int = 1):
+        engine = Crosstab(chunk)
+        for col_breakout in [None, *self.col_breakouts]:
+            self.counts[col_breakout] = _add(
+                self.counts.get(col_breakout),
+                engine.counts(self.col_question, col_breakout),
+                sign,
+            )
+
+    def remove(self, chunk: pd.DataFrame):
+        self.update(chunk, sign=-1)
+
+    def merge(self, other: "SingleChoiceAggregator") -> "SingleChoiceAggregator":
+        """合并另一份数据（其他文件或进程）的计数"""
+        merged = SingleChoiceAggregator(
+            self.col_question, self.col_breakouts, self.weights
+        )
+        for key in [*self.counts, *(k for k in other.counts if k not in self.counts)]:
+            merged.counts[key] = (
+                _add(self.counts.get(key), other.counts[key])
+                if key in other.counts
+                else self.counts[key]
+            )
+        return merged
+
+    def get_counts(
+        self, col_breakout: Optional[str] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        return self.counts[col_breakout]
+
+    def get_stats(
+        self,
+        col_breakout: Optional[str] = None,
+        percentage: bool = True,
+        sorter: Optional[List[str]] = None,
+        add_base: bool = True,
+    ) -> pd.DataFrame:
+        return choice_stats(
+            self.get_counts(),
+            self.get_counts(col_breakout) if col_breakout else None,
+            percentage=percentage,
+            sorter=sorter,
+            add_base=add_base,
+        )
+
+    def weighted_avg(
+        self, col_breakout: Optional[str] = None
+    ) -> Union[float, pd.Series]:
+        return weighted_avg_from_counts(self.get_counts(col_breakout), self.weights)
+
+
+class MultipleChoiceAggregator:
+    """逐块累加多选题选项计数和有效样本数"""
+
+    def __init__(
+        self,
+        col_question: str,
+        col_breakouts: Optional[List[str]] = None,
+        delimiter: str = "┋",
+    ):
+        self.col_question = col_question
+        self.col_breakouts = col_breakouts or []
+        self.delimiter = delimiter
+        self.counts = {}
+        self.n = {}
+
+    def update(self, chunk: pd.DataFrame, sign: int = 1):
+        indicator = indicator_matrix(chunk[self.col_question], self.delimiter)
+        valid = chunk[self.col_question].notna()
+
+        self.counts[None] = _add(self.counts.get(None), indicator.sum(), sign)
+        self.n[None] = self.n.get(None, 0) + sign * int(valid.sum())
+        for col_breakout in self.col_breakouts:
+            self.counts[col_breakout] = _add(
+                self.counts.get(col_breakout),
+                indicator.groupby(chunk[col_breakout], observed=True).sum().T,
+                sign,
+            )
+            self.n[col_breakout] = _add(
+                self.n.get(col_breakout),
+                valid.groupby(chunk[col_breakout], observed=True).sum(),
+                sign,
+            )
+
+    def remove(self, chunk: pd.DataFrame):
+        self.update(chunk, sign=-1)
+
+    def merge(self, other: "MultipleChoiceAggregator") -> "MultipleChoiceAggregator":
+        merged = MultipleChoiceAggregator(
+            self.col_question, self.col_breakouts, self.delimiter
+        )
+        for key in [*self.counts, *(k for k in other.counts if k not in self.counts)]:
+            if key not in other.counts:
+                merged.counts[key], merged.n[key] = self.counts[key], self.n[key]
+                continue
+            merged.counts[key] = _add(self.counts.get(key), other.counts[key])
+            merged.n[key] = (
+                self.n.get(key, 0) + other.n[key]
+                if key is None
+                else _add(self.n.get(key), other.n[key])
+            )
+        return merged
+
+    def get_stats(
+        self, col_breakout: Optional[str] = None, sorter: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        return multiple_choice_stats(
+            self.counts[None],
+            self.n[None],
+            self.counts[col_breakout] if col_breakout else None,
+            self.n[col_breakout] if col_breakout else None,
+            sorter=sorter,
+        )
+
+
+class NumericAggregator:
+    """精确统计：保留全部答卷的数值列及拆分列，内存随数据量线性增长（O(n)）
+
+    分位数需要完整数据，remove也需要按索引删除原始值，因此不能只保留汇总量；
+    不需要remove的大文件或分片数据请使用NumericSketchAggregator，内存固定，分位数为近似值
+    """
+
+    def __init__(self, col_question: str, col_breakouts: Optional[List[str]] = None):
+        self.col_question = col_question
+        self.col_breakouts = col_breakouts or []
+        self.parts = []
+
+    def update(self, chunk: pd.DataFrame):
+        self.parts.append(chunk[[self.col_question, *self.col_breakouts]])
+
+    def remove(self, chunk: pd.DataFrame):
+        """按索引删除，要求各块的索引互不重复"""
+        self.parts = [pd.concat(self.parts).drop(chunk.index)]
+
+    def result(self) -> ResultNumericValue:
+        return ResultNumericValue(pd.concat(self.parts), self.col_question)
+
+    def get_stats(self, col_breakout: Optional[str] = None) -> pd.DataFrame:
+        return self.result().get_stats(col_breakout)
+
+
+class NumericSketchAggregator:
+    """数值题的草图版本：每个分组只保存一个NumericSketch，内存不随数据量增长
+
+    分位数为近似值（秩误差约1.7/k），bins取edges的子集时分组计数是精确的；
+    不同分块、文件或进程的聚合器可以用merge合并，但不支持remove，
+    因此不能用于IncrementalSurvey
+    """
+
+    def __init__(
+        self,
+        col_question: str,
+        edges: Optional[List[float]] = None,
+        col_breakouts: Optional[List[str]] = None,
+        k: int = 200,
+    ):
+        self.col_question = col_question
+        self.edges = edges
+        self.col_breakouts = col_breakouts or []
+        self.k = k
+        # None → 全部；拆分字段 → {分组: 草图}
+        self.sketches: Dict[Optional[str], Union[NumericSketch, Dict]] = {
+            None: NumericSketch(edges, k),
+            **{col: {} for col in self.col_breakouts},
+        }
+
+    def update(self, chunk: pd.DataFrame):
+        values = chunk[self.col_question].astype(float)
+        self.sketches[None].update(values)
+        for col_breakout in self.col_breakouts:
+            groups = self.sketches[col_breakout]
+            for group, part in values.groupby(chunk[col_breakout], observed=True):
+                groups.setdefault(group, NumericSketch(self.edges, self.k)).update(part)
+
+    def merge(self, other: "NumericSketchAggregator") -> "NumericSketchAggregator":
+        merged = NumericSketchAggregator(
+            self.col_question, self.edges, self.col_breakouts, self.k
+        )
+        merged.sketches[None] = self.sketches[None] + other.sketches[None]
+        for col_breakout in self.col_breakouts:
+            groups = dict(self.sketches[col_breakout])
+            for group, sketch in other.sketches[col_breakout].items():
+                groups[group] = groups[group] + sketch if group in groups else sketch
+            merged.sketches[col_breakout] = groups
+        return merged
+
+    def get_stats(
+        self, col_breakout: Optional[str] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """格式与ResultNumericValue.get_stats一致"""
+        if not col_breakout:
+            return self.sketches[None].describe()
+
+        groups = {
+            group: sketch
+            for group, sketch in self.sketches[col_breakout].items()
+            if sketch.n
+        }
+        stats = pd.DataFrame([sketch.describe() for sketch in groups.values()])
+        stats.insert(0, "计数", [sketch.n for sketch in groups.values()])
+        stats.index = [f"{group}\n(n={sketch.n})" for group, sketch in groups.items()]
+        return stats
+
+    def get_stats_by_bins(self, bins: List[float]) -> pd.DataFrame:
+        return self.sketches[None].stats_by_bins(bins)
+
+    def plot(
+        self,
+        bins: Optional[List[float]] = None,
+        width: float = 15,
+        height: float = 6,
+        fmt: str = "{:.0f}",
+        fontsize: float = 12,
+    ) -> str:
+        """由直方图草图画分组频数柱状图，bins默认为edges"""
+        bins = self.edges if bins is None else bins
+        if bins is None:
+            raise ValueError("没有指定直方图边界")
+        counts = self.sketches[None].counts_by_bins(bins)
+        counts.index = counts.index.astype(str)
+
+        plt, GridFigure = plotting_backend()
+        f = plt.figure(
+            FigureClass=GridFigure,
+            width=width,
+            height=height,
+            fontsize=fontsize,
+            style={
+                "title": f"{self.col_question}\n(数值填空, n={self.sketches[None].n})",
+            },
+        )
+        f.plot(
+            kind="bar",
+            data=counts,
+            ax_index=0,
+            fmt=fmt,
+            style={
+                "ylabel": "频数",
+                "xlabel": self.col_question,
+                "show_legend": False,
+            },
+        )
+        return f.save()
+
+
+def stream_survey(
+    file_path: str,
+    aggregators: Iterable,
+    settings_path: str = "设置.xlsx",
+    chunksize: int = 50000,
+) -> Iterable:
+    """分块清洗导出文件并依次喂给各聚合器"""
+    for chunk in clean_data_chunks(file_path, settings_path, chunksize):
+        for aggregator in aggregators:
+            aggregator.update(chunk)
+    return aggregators
@@ -1,12 +1,18 @@
-from os import path
-import sys
 import pandas as pd
-
-sys.path.append(path.abspath("../chart_class"))
-from typing import List, Dict, Optional
-import matplotlib.pyplot as plt
-from figure import GridFigure
-from data_clean import clean_data
+from typing import List, Dict, Optional, Union
+from bootstrap import share_ci, weighted_avg_ci
+from profiling import profiled
+from render import plotting_backend
+from sketch import Histogram, NumericSketch, bin_stats
+from crosstab import (
+    BreakoutCube,
+    choice_stats,
+    describe_numeric,
+    get_crosstab,
+    indicator_cube,
+    indicator_matrix,
+    multiple_choice_stats,
+)
 
 
 class Result:
@@ -39,82 +45,120 @@ class ResultSingleChoice(Result):
             qtype,
         )
         self.weights = weights
+        self.crosstab = get_crosstab(df)
+
+    def get_counts(
+        self, col_breakout: Union[str, List[str], None] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        return self.crosstab.counts(self.col_question, col_breakout)
+
+    def cube(self, breakouts: List[str]) -> BreakoutCube:
+        """多层拆分的稀疏计数立方体，边际和子集由求和得到"""
+        return self.crosstab.cube(self.col_question, breakouts)
 
-    def get_n(self, col_breakout: Optional[str] = None) -> pd.Series:
+    def get_n(self, col_breakout: Union[str, List[str], None] = None) -> pd.Series:
         if col_breakout:
-            return self.df.groupby(col_breakout)[self.col_question].count()
+            counts = self.get_counts(col_breakout).sum()
+            return counts[counts > 0]
         else:
             return self.valid_n
 
+    @profiled("ResultSingleChoice.get_stats")
     def get_stats(
         self,
-        col_breakout: Optional[str] = None,
+        col_breakout: Union[str, List[str], None] = None,
         percentage: bool = True,
         sorter: Optional[List[str]] = None,
         add_base: bool = True,
     ) -> pd.DataFrame:
 
-        stats_total = self.data.value_counts()
-        if percentage:
-            stats_total = stats_total.div(self.valid_n)
-
-        stats_total.sort_values(ascending=False, inplace=True)
-        print(stats_total)
-
-        if col_breakout:
-            stats_breakout = (
-                self.df[[col_breakout, self.col_question]]
-                .groupby(col_breakout)[self.col_question]
-                .value_counts()
-                .unstack(fill_value=0)
-                .T
-            ).reindex(stats_total.index)
-            count = stats_breakout.sum()
-            if percentage:
-                stats_breakout = stats_breakout.div(count)
-
-            if add_base:
-                stats_breakout.columns = (
-                    stats_breakout.columns + "\n(n=" + count.astype(str) + ")"
-                )
-
-        stats = stats_breakout if col_breakout else stats_total
-        if sorter:
-            stats = stats.reindex(sorter)
-
-        return stats
+        return choice_stats(
+            self.get_counts(),
+            self.get_counts(col_breakout) if col_breakout else None,
+            percentage=percentage,
+            sorter=sorter,
+            add_base=add_base,
+        )
 
+    @profiled("ResultSingleChoice.weighted_avg")
     def weighted_avg(
         self,
-        col_breakout: Optional[str] = None,
+        col_breakout: Union[str, List[str], None] = None,
         add_base: bool = True,
     ) -> float:
 
         if col_breakout:
             try:
-                stats_breakout = self.get_stats(col_breakout, percentage=False, add_base=False)
-                count = stats_breakout.sum()
+                count = self.get_n(col_breakout)
+                weighted_avg = self.crosstab.weighted_avg(
+                    self.col_question, self.weights, col_breakout
+                ).reindex(count.index)
 
-                weighted_avg = self.df.groupby(col_breakout)[self.col_question].apply(
-                    lambda x: x.map(self.weights).mean()
-                )
-                
                 print(weighted_avg)
                 if add_base:
                     weighted_avg.index = (
-                        stats_breakout.columns + "\n(n=" + count.astype(str) + ")"
+                        weighted_avg.index + "\n(n=" + count.astype(str) + ")"
                     )
-                    
+
                 return weighted_avg
 
             except Exception:
                 return None
         else:
             try:
-                return self.data.map(self.weights).mean()
+                return self.crosstab.weighted_avg(self.col_question, self.weights)
             except Exception:
                 return None
 
+    def _ci_counts(
+        self, col_breakout: Union[str, List[str], None] = None
+    ) -> pd.DataFrame:
+        """与get_stats相同的选项和分组：去掉计数为0的选项和分组"""
+        counts_total = self.get_counts()
+        counts_total = counts_total[counts_total > 0]
+        if not col_breakout:
+            return counts_total
+        return self.get_counts(col_breakout).reindex(
+            index=counts_total.index,
+            columns=self.get_n(col_breakout).index,
+            fill_value=0,
+        )
+
+    @profiled("ResultSingleChoice.get_ci")
+    def get_ci(
+        self,
+        col_breakout: Union[str, List[str], None] = None,
+        n_resamples: int = 10000,
+        level: float = 0.95,
+        seed: int = 0,
+        workers: int = 1,
+    ) -> pd.DataFrame:
+        """各选项占比的bootstrap置信区间，有拆分时列为(分组, [百分比, 下限, 上限])"""
+        return share_ci(
+            self._ci_counts(col_breakout), None, n_resamples, level, seed, workers
+        )
+
+    @profiled("ResultSingleChoice.weighted_avg_ci")
+    def weighted_avg_ci(
+        self,
+        col_breakout: Union[str, List[str], None] = None,
+        n_resamples: int = 10000,
+        level: float = 0.95,
+        seed: int = 0,
+        workers: int = 1,
+    ) -> Union[pd.Series, pd.DataFrame, None]:
+        """加权平均的bootstrap置信区间，有拆分时每个分组一行"""
+        if not self.weights:
+            return None
+        return weighted_avg_ci(
+            self._ci_counts(col_breakout),
+            self.weights,
+            n_resamples,
+            level,
+            seed,
+            workers,
+        )
+
 
 class ResultMultipleChoice(Result):
 
@@ -124,42 +168,110 @@ class ResultMultipleChoice(Result):
         col_question: str,
         qtype: str = "多选",
         delimiter: str = "┋",
+        indicator: Optional[pd.DataFrame] = None,
+        breakout_counts: Optional[Dict[str, pd.DataFrame]] = None,
     ):
+        """indicator、breakout_counts为批量分析时预先算好的指示矩阵和 选项×分组 计数"""
         super().__init__(
             df,
             col_question,
             qtype,
         )
         self.delimiter = delimiter
+        self._indicator = indicator
+        self._breakout_counts = dict(breakout_counts or {})
+        self._cubes = {}
+
+    @property
+    def indicator(self) -> pd.DataFrame:
+        """受访者×选项的布尔矩阵，每道题只拆分一次字符串"""
+        if self._indicator is None:
+            self._indicator = indicator_matrix(self.data, self.delimiter)
+        return self._indicator
+
+    def cube(self, breakouts: List[str]) -> BreakoutCube:
+        """多层拆分的稀疏计数立方体，边际和子集由求和得到"""
+        key = tuple(breakouts)
+        if key not in self._cubes:
+            combos, levels = get_crosstab(self.df).combo_codes(list(breakouts))
+            self._cubes[key] = indicator_cube(
+                self.indicator,
+                self.data.notna().to_numpy(),
+                combos,
+                levels,
+                self.col_question,
+            )
+        return self._cubes[key]
 
-    def get_stats(
-        self, col_breakout: Optional[str], sorter: Optional[List[str]] = None
+    def get_counts(
+        self, col_breakout: Union[str, List[str], None] = None
     ) -> pd.DataFrame:
-        stats = pd.DataFrame()
-        stats["计数"] = self.data.str.split(self.delimiter).explode().value_counts()
-        stats["百分比"] = stats["计数"] / self.valid_n
+        """选项计数，有拆分时返回 选项×分组 矩阵，多层拆分时列为分组组合"""
+        if col_breakout is None:
+            return self.indicator.sum()
+        if isinstance(col_breakout, (list, tuple)):
+            return self.cube(col_breakout).matrix()
+
+        if col_breakout not in self._breakout_counts:
+            self._breakout_counts[col_breakout] = (
+                self.indicator.groupby(self.df[col_breakout], observed=True)
+                .sum()
+                .T
+            )
+        return self._breakout_counts[col_breakout]
 
+    def get_n(self, col_breakout: Union[str, List[str], None] = None) -> pd.Series:
+        if isinstance(col_breakout, (list, tuple)):
+            return self.cube(col_breakout).n()
         if col_breakout:
-            stats_breakout = (
-                self.df.groupby(col_breakout)[self.col_question]
-                .apply(
-                    lambda x: x.str.split(self.delimiter)
-                    .explode()
-                    .value_counts(normalize=True)
-                )
-                .unstack()
-                .fillna(0)
+            return (
+                self.data.notna()
+                .groupby(self.df[col_breakout], observed=True)
+                .sum()
             )
-            stats_breakout.columns = stats_breakout.columns.map(
-                lambda x: f"{self.col_question}={x}"
-            )
-            stats = stats.join(stats_breakout)
+        else:
+            return self.valid_n
 
-        if sorter:
-            stats = stats.reindex(sorter)
+    @profiled("ResultMultipleChoice.get_stats")
+    def get_stats(
+        self,
+        col_breakout: Union[str, List[str], None] = None,
+        sorter: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        return multiple_choice_stats(
+            self.get_counts(),
+            self.valid_n,
+            self.get_counts(col_breakout) if col_breakout else None,
+            self.get_n(col_breakout) if col_breakout else None,
+            sorter=sorter,
+        )
 
-        return stats
+    @profiled("ResultMultipleChoice.get_ci")
+    def get_ci(
+        self,
+        col_breakout: Union[str, List[str], None] = None,
+        n_resamples: int = 10000,
+        level: float = 0.95,
+        seed: int = 0,
+        workers: int = 1,
+    ) -> pd.DataFrame:
+        """各选项提及率的bootstrap置信区间，分母为有效样本量"""
+        if not col_breakout:
+            return share_ci(
+                self.get_counts(), self.valid_n, n_resamples, level, seed, workers
+            )
+        n = self.get_n(col_breakout)
+        n = n[n > 0]
+        return share_ci(
+            self.get_counts(col_breakout)[n.index],
+            n,
+            n_resamples,
+            level,
+            seed,
+            workers,
+        )
 
+    @profiled("ResultMultipleChoice.plot")
     def plot(
         self,
         sorter: Optional[List[str]] = None,
@@ -167,6 +279,7 @@ class ResultMultipleChoice(Result):
         height: float = 6,
         fontsize: float = 12,
     ) -> str:
+        plt, GridFigure = plotting_backend()
         f = plt.figure(
             FigureClass=GridFigure,
             width=width,
@@ -206,34 +319,32 @@ class ResultNumericValue(Result):
             qtype,
         )
 
-    def get_stats(self, col_breakout: Optional[str] = None) -> pd.DataFrame:
-        stats = pd.Series(dtype=float)
-        stats["平均值"] = self.data.mean()
-        stats["标准差"] = self.data.std()
-        stats["最小值"] = self.data.min()
-        stats["25%分位数"] = self.data.quantile(0.25)
-        stats["中位数"] = self.data.median()
-        stats["75%分位数"] = self.data.quantile(0.75)
-        stats["最大值"] = self.data.max()
-
-        if col_breakout:
-            stats = (
-                self.df[[col_breakout, self.col_question]]
-                .groupby(col_breakout)
-                .agg(["count", "mean"])
-            )
-            stats.index = stats.index + "\n(n=" + stats["count"].astype(str) + ")"
-
+    @profiled("ResultNumericValue.get_stats")
+    def get_stats(
+        self, col_breakout: Optional[str] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """无拆分时返回全部描述统计；有拆分时每个分组一行，分组名带样本量"""
+        stats = describe_numeric(self.df, [self.col_question], col_breakout)
+        if not col_breakout:
+            return stats.iloc[0].drop("计数").rename(None)
+
+        stats = stats.loc[self.col_question]
+        stats.index = stats.index.astype(str) + "\n(n=" + stats["计数"].astype(str) + ")"
         return stats
 
+    @profiled("ResultNumericValue.get_stats_by_bins")
     def get_stats_by_bins(self, bins: List[float]) -> pd.DataFrame:
-        stats = pd.DataFrame()
-        stats["计数"] = pd.cut(self.data, bins).value_counts().sort_index()
-        stats["百分比"] = stats["计数"] / self.valid_n
-        stats["百分比"] = stats["百分比"].map(lambda x: f"{x:.1%}")
+        counts = Histogram(bins).update(self.data.astype(float)).counts
+        index = pd.IntervalIndex.from_breaks(bins, closed="right")
+        return bin_stats(pd.Series(counts, index=index), self.valid_n)
 
-        return stats
+    def sketch(
+        self, edges: Optional[List[float]] = None, k: int = 200
+    ) -> NumericSketch:
+        """可合并的摘要，多个分块或文件的结果相加后再取分位数和分组计数"""
+        return NumericSketch(edges, k).update(self.data.astype(float))
 
+    @profiled("ResultNumericValue.plot")
     def plot(
         self,
         width: float = 15,
@@ -241,6 +352,7 @@ class ResultNumericValue(Result):
         fmt: str = "{:.0f}",
         fontsize: float = 12,
     ) -> str:
+        plt, GridFigure = plotting_backend()
         f = plt.figure(
             FigureClass=GridFigure,
             width=width,
@@ -267,6 +379,8 @@ class ResultNumericValue(Result):
 
 
 if __name__ == "__main__":
+    from data_clean import clean_data
+
     df = clean_data("265857608_按文本_ND-CKD患者肾性贫血治疗观念调研_107_90.xlsx")
     q1 = ResultSingleChoice(
         df,